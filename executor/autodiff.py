@@ -0,0 +1,153 @@
+import itertools
+import math
+from typing import Any
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, duals also hold plain floats
+    np = None
+
+# tags tell apart the perturbations of nested derivatives, inner derivatives get higher tags
+_tags = itertools.count(1)
+
+
+def next_tag() -> int:
+    return next(_tags)
+
+
+class Dual:
+    """
+    A dual number value + derivative * e for forward mode differentiation, with e * e = 0.
+    The parts are floats, numpy arrays or duals of lower tags for nested derivatives
+    """
+
+    value: Any
+    derivative: Any
+    tag: int
+
+    # make numpy defer to the reflected operators rather than building object arrays
+    __array_ufunc__ = None
+
+    def __init__(self, value: Any, derivative: Any, tag: int) -> None:
+        self.value = value
+        self.derivative = derivative
+        self.tag = tag
+
+    def __repr__(self) -> str:
+        return f"Dual({self.value!r}, {self.derivative!r}, tag={self.tag})"
+
+    def __add__(self, other):
+        tag, (a, da), (b, db) = _split(self, other)
+        return Dual(a + b, da + db, tag)
+
+    def __radd__(self, other):
+        tag, (a, da), (b, db) = _split(other, self)
+        return Dual(a + b, da + db, tag)
+
+    def __sub__(self, other):
+        tag, (a, da), (b, db) = _split(self, other)
+        return Dual(a - b, da - db, tag)
+
+    def __rsub__(self, other):
+        tag, (a, da), (b, db) = _split(other, self)
+        return Dual(a - b, da - db, tag)
+
+    def __mul__(self, other):
+        tag, (a, da), (b, db) = _split(self, other)
+        return Dual(a * b, a * db + da * b, tag)
+
+    def __rmul__(self, other):
+        tag, (a, da), (b, db) = _split(other, self)
+        return Dual(a * b, a * db + da * b, tag)
+
+    def __truediv__(self, other):
+        tag, (a, da), (b, db) = _split(self, other)
+        return Dual(a / b, (da * b - a * db) / (b * b), tag)
+
+    def __rtruediv__(self, other):
+        tag, (a, da), (b, db) = _split(other, self)
+        return Dual(a / b, (da * b - a * db) / (b * b), tag)
+
+    def __pow__(self, other):
+        return _pow(self, other)
+
+    def __rpow__(self, other):
+        return _pow(other, self)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.derivative, self.tag)
+
+
+def _parts(x: Any, tag: int) -> tuple[Any, Any]:
+    # anything not perturbed by the tag is a constant for it
+    if isinstance(x, Dual) and x.tag == tag:
+        return x.value, x.derivative
+    return x, 0
+
+
+def _split(a: Any, b: Any) -> tuple[int, tuple[Any, Any], tuple[Any, Any]]:
+    tag = max(x.tag for x in (a, b) if isinstance(x, Dual))
+    return tag, _parts(a, tag), _parts(b, tag)
+
+
+def _is_zero(x: Any) -> bool:
+    # only the derivatives of constants are known to be zero, arrays are always computed
+    return isinstance(x, (int, float)) and x == 0
+
+
+def _pow(base: Any, exponent: Any) -> Dual:
+    tag, (a, da), (b, db) = _split(base, exponent)
+    value = a ** b
+
+    # the log term is skipped for constant exponents, so negative bases still work
+    derivative = 0
+    if not _is_zero(da):
+        derivative = derivative + b * a ** (b - 1) * da
+    if not _is_zero(db):
+        derivative = derivative + value * log(a) * db
+
+    return Dual(value, derivative, tag)
+
+
+def _is_array(x: Any) -> bool:
+    return np is not None and isinstance(x, np.ndarray)
+
+
+# elementary functions of floats, numpy arrays and duals
+def sin(x: Any) -> Any:
+    if isinstance(x, Dual):
+        return Dual(sin(x.value), cos(x.value) * x.derivative, x.tag)
+    return np.sin(x) if _is_array(x) else math.sin(x)
+
+
+def cos(x: Any) -> Any:
+    if isinstance(x, Dual):
+        return Dual(cos(x.value), -sin(x.value) * x.derivative, x.tag)
+    return np.cos(x) if _is_array(x) else math.cos(x)
+
+
+def exp(x: Any) -> Any:
+    if isinstance(x, Dual):
+        value = exp(x.value)
+        return Dual(value, value * x.derivative, x.tag)
+    return np.exp(x) if _is_array(x) else math.exp(x)
+
+
+def log(x: Any) -> Any:
+    if isinstance(x, Dual):
+        return Dual(log(x.value), x.derivative / x.value, x.tag)
+    return np.log(x) if _is_array(x) else math.log(x)
+
+
+def seed(value: Any, tag: int) -> Dual:
+    """
+    Returns the dual of an independent variable, with derivative one
+    """
+    return Dual(value, 1.0, tag)
+
+
+def unseed(result: Any, tag: int) -> tuple[Any, Any]:
+    """
+    Returns the value and derivative of a result with respect to the variable seeded with the tag
+    """
+    return _parts(result, tag)
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+from typing import Iterable, Iterator
+
+from executor.rule import Rule
+from executor.simplify import simplify_expression
+from symbols import Expression
+from symbols.overload import overload
+from symbols.serialize import to_bytes, from_bytes
+
+# the extra rules of the worker process, set by the pool initializer
+_rules: list[Rule] | None = None
+
+
+def _initialize(rules: list[Rule] | None) -> None:
+    # workers may be spawned fresh, so they set up the same environment as the caller
+    global _rules
+    overload()
+    _rules = rules
+
+
+def _simplify(data: bytes) -> bytes:
+    return to_bytes(simplify_expression(from_bytes(data), _rules))
+
+
+def simplify_many(expressions: Iterable[Expression], workers: int | None = None, chunksize: int = 16,
+                  rules: list[Rule] | None = None) -> Iterator[Expression]:
+    """
+    Simplifies independent expressions across a pool of processes. Identical inputs are simplified once,
+    and the expressions travel between the processes in the binary format
+    :param expressions: The expressions, which are not modified
+    :param workers: The number of processes, all the cores by default, 1 to simplify in this process
+    :param chunksize: The number of expressions sent to a worker at a time
+    :param rules: The extra rules, must be picklable
+    :return: The simplified expressions in the input order, yielded as soon as they and all before them are done
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"at least one worker is needed, got {workers}")
+
+    # the index of every input into the distinct inputs, in order of first appearance
+    distinct: dict[bytes, int] = {}
+    indices = [distinct.setdefault(to_bytes(expression), len(distinct)) for expression in expressions]
+    if not indices:
+        return
+
+    if workers == 1 or len(distinct) == 1:
+        _initialize(rules)
+        results = map(_simplify, distinct)
+        yield from _reorder(indices, results)
+        return
+
+    with multiprocessing.Pool(min(workers, len(distinct)), _initialize, (rules,)) as pool:
+        results = pool.imap(_simplify, distinct, chunksize)
+        yield from _reorder(indices, results)
+
+
+def _reorder(indices: list[int], results: Iterator[bytes]) -> Iterator[Expression]:
+    # distinct inputs are numbered in order of first appearance, so each input only waits for its own result
+    done: list[bytes] = []
+    for index in indices:
+        while len(done) <= index:
+            done.append(next(results))
+        # duplicates get their own tree, so the callers can modify them independently
+        yield from_bytes(done[index])
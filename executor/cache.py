@@ -0,0 +1,5 @@
+from symbols.cache import LRUCache
+
+# the process wide simplification cache, keyed by (rule set, expression),
+# the cached expressions are shared between callers, so the appliers hand out copies of them
+simplify_cache = LRUCache(1 << 16)
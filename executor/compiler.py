@@ -0,0 +1,116 @@
+import keyword
+import math
+from typing import Callable, Iterable
+
+from symbols.cache import LRUCache
+from symbols import literal, binary, unary, function, nary
+from symbols.node import Expression, Node, postorder
+
+
+class CompileError(RuntimeError):
+    pass
+
+
+# the python expression of each node class, formatted with the names of its operands
+_templates: dict[type[Node], str] = {
+    binary.Add: '{0} + {1}',
+    binary.Sub: '{0} - {1}',
+    binary.Mul: '{0} * {1}',
+    binary.Div: '{0} / {1}',
+    binary.Pow: '{0} ** {1}',
+    unary.Negate: '-{0}',
+    function.Sin: '_math.sin({0})',
+    function.Cos: '_math.cos({0})',
+    function.Exp: '_math.exp({0})',
+    function.Log: '_math.log({0})',
+}
+
+
+def _constant(number: float) -> str:
+    if not math.isfinite(number):
+        return f"_float('{number}')"
+    if number < 0:
+        return f"({number!r})"
+    return repr(number)
+
+
+def _check_arguments(args: Iterable[str]) -> tuple[str, ...]:
+    args = tuple(args)
+    for name in args:
+        # the names starting with an underscore are reserved for the generated code
+        if not name.isidentifier() or keyword.iskeyword(name) or name.startswith('_'):
+            raise CompileError(f"unable to use '{name}' as an argument name")
+
+    if len(set(args)) != len(args):
+        raise CompileError(f"duplicate argument names, args = {list(args)}")
+
+    return args
+
+
+def generate_source(expression: Expression, args: Iterable[str], name: str = 'compiled') -> str:
+    """
+    Generates the source of a python function computing the expression, one statement per operation.
+    Structurally equal subtrees are computed once
+    :param expression: The expression
+    :param args: The variable names, in the order of the function parameters
+    :param name: The function name
+    :return: The function source
+    """
+    args = _check_arguments(args)
+
+    lines = [f"def {name}({', '.join(args)}):"]
+    names: dict[Node, str] = {}  # the python name or constant of every computed subtree
+    for node in postorder(expression, lambda n: n in names):
+        if node in names:
+            continue
+
+        match node:
+            case literal.Real():
+                names[node] = _constant(node.number)
+
+            case literal.Variable():
+                if node.symbol not in args:
+                    raise CompileError(f"unbound variable '{node.symbol}', args = {list(args)}")
+                names[node] = node.symbol
+
+            case _:
+                if isinstance(node, nary.NAry):
+                    template = f' {node.operator} '.join(f'{{{index}}}' for index in range(len(node.children)))
+                else:
+                    template = _templates.get(node.__class__)
+                if template is None:
+                    raise TypeError(f"unsupported node type, {type(node)}")
+
+                temporary = f"_t{len(lines) - 1}"
+                lines.append(f"    {temporary} = {template.format(*(names[child] for child in node.children))}")
+                names[node] = temporary
+
+    lines.append(f"    return {names[expression]}")
+    return '\n'.join(lines) + '\n'
+
+
+# compiled functions of recently compiled (expression, args)
+compile_cache = LRUCache(1024)
+
+
+def compile_expression(expression: Expression, args: Iterable[str] | None = None) -> Callable[..., float]:
+    """
+    Compiles the expression into a python function of its variables
+    :param expression: The expression
+    :param args: The variable names, in the order of the function parameters, sorted free variables by default
+    :return: The function, mapping the variable values to the value of the expression
+    """
+    args = tuple(sorted(expression.free_variables) if args is None else args)
+
+    compiled = compile_cache.get((expression, args))
+    if compiled is not None:
+        return compiled
+
+    source = generate_source(expression, args)
+    namespace = {'_math': math, '_float': float}
+    exec(compile(source, '<compile_expression>', 'exec'), namespace)
+
+    compiled = namespace['compiled']
+    compiled.source = source
+    compile_cache.put((expression, args), compiled)
+    return compiled
@@ -0,0 +1,115 @@
+from typing import Iterator, Mapping
+
+from executor.evaluator import evaluate
+from symbols import literal, operator
+from symbols.intern import NodeFactory
+from symbols.node import Expression, Node, fold, postorder
+
+Bindings = list[tuple[str, Expression]]
+
+
+def share(expression: Expression) -> Expression:
+    """
+    Returns the expression as a DAG where structurally equal subtrees are the same (frozen) object,
+    so the evaluator and compiler compute each of them once
+    :param expression: The expression, which is not modified
+    :return: The shared expression
+    """
+    return NodeFactory().intern(expression)
+
+
+def _names(prefix: str, taken: frozenset[str]) -> Iterator[str]:
+    index = 0
+    while True:
+        name = f"{prefix}{index}"
+        if name not in taken:
+            yield name
+        index += 1
+
+
+def eliminate_common_subexpressions(expression: Expression, prefix: str = 'c') -> tuple[Bindings, Expression]:
+    """
+    Hoists the subtrees appearing more than once into let bindings, the bound expressions refer to the earlier
+    bindings as variables. Derivatives are opaque, as their expression must stay a function of their variable
+    :param expression: The expression, which is not modified
+    :param prefix: The prefix of the binding names, the names of the expression variables are skipped
+    :return: The bindings in evaluation order, and the root expression
+    """
+    shared = share(expression)
+
+    def opaque(node: Node) -> bool:
+        return isinstance(node, operator.Diff)
+
+    # the number of times each distinct subtree is used by a parent
+    uses: dict[int, int] = {}
+    for node in postorder(shared, leaf=opaque):
+        if opaque(node):
+            continue
+        for child in node.children:
+            uses[id(child)] = uses.get(id(child), 0) + 1
+
+    bindings: Bindings = []
+    names = _names(prefix, expression.free_variables)
+
+    def bind(node: Node, children: list[Expression]) -> Expression:
+        shared_uses = uses.get(id(node), 0)
+        if any(new is not old for new, old in zip(children, node.children)):
+            node = node.with_children(children)
+
+        # leaves are cheaper to repeat than to name
+        if not node.children or shared_uses < 2:
+            return node
+
+        name = next(names)
+        bindings.append((name, node))
+        return literal.Variable(name)
+
+    root = fold(shared, bind, leaf=opaque)
+    return bindings, root
+
+
+def inline(bindings: Bindings, root: Expression) -> Expression:
+    """
+    Substitutes the bindings back, giving a DAG where every binding is a single shared subtree
+    :param bindings: The bindings in evaluation order
+    :param root: The root expression
+    :return: The shared expression
+    """
+    values: dict[str, Expression] = {}
+
+    def substitute(node: Node, children: list[Expression]) -> Expression:
+        if isinstance(node, literal.Variable):
+            return values.get(node.symbol, node)
+        if any(new is not old for new, old in zip(children, node.children)):
+            return node.with_children(children)
+        return node
+
+    for name, expression in bindings:
+        values[name] = fold(expression, substitute)
+    return fold(root, substitute)
+
+
+def evaluate_bindings(bindings: Bindings, root: Expression, env: Mapping[str, float]) -> float:
+    """
+    Evaluates the bindings in order, then the root
+    :param bindings: The bindings in evaluation order
+    :param root: The root expression
+    :param env: The variable names mapped to their values
+    :return: The value of the root
+    """
+    env = dict(env)
+    for name, expression in bindings:
+        env[name] = evaluate(expression, env)
+    return evaluate(root, env)
+
+
+def display_bindings(bindings: Bindings, root: Expression) -> str:
+    """
+    Prints the bindings one per line, followed by the root
+    :param bindings: The bindings in evaluation order
+    :param root: The root expression
+    :return: The printed lines
+    """
+    lines = [f"{name} = {expression.as_display()}" for name, expression in bindings]
+    lines.append(root.as_display())
+    return '\n'.join(lines)
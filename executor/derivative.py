@@ -0,0 +1,94 @@
+from typing import Iterable
+
+from executor.cache import simplify_cache
+from executor.rule import Rule
+from executor.simplify import simplify_expression
+from executor.store import ResultStore
+from symbols.cache import LRUCache
+from symbols import Expression, literal, operator
+
+
+class DerivativeTower:
+    """
+    The simplified partial derivatives of an expression, of any order. Every derivative is computed from the
+    cached one of an order lower, and mixed partials are cached once regardless of the order of the variables
+    """
+
+    expression: Expression
+    rules: list[Rule] | None
+    cache: LRUCache | None
+    store: ResultStore | None
+    _derivatives: dict[tuple[str, ...], Expression]
+
+    def __init__(self, expression: Expression, rules: list[Rule] | None = None,
+                 cache: LRUCache | None = simplify_cache, store: ResultStore | None = None) -> None:
+        """
+        :param expression: The expression, which is not modified
+        :param rules: The extra simplification rules
+        :param cache: The cache of simplified subtrees, see simplify_expression
+        :param store: The persistent store of simplified expressions, see simplify_expression
+        """
+        self.expression = expression
+        self.rules = rules
+        self.cache = cache
+        self.store = store
+        self._derivatives = {(): simplify_expression(expression, rules, cache=cache, store=store)}
+
+    def derivative(self, *variables: str) -> Expression:
+        """
+        Returns the partial derivative with respect to the variables in turn, the expression itself for none
+        """
+        # mixed partials commute, so the variables are a multiset
+        key = tuple(sorted(variables))
+
+        # start from the highest order already computed
+        known = len(key)
+        while key[:known] not in self._derivatives:
+            known -= 1
+
+        result = self._derivatives[key[:known]]
+        for index in range(known, len(key)):
+            variable = key[index]
+            if variable in result.free_variables or result.has_diff:
+                result = simplify_expression(operator.Diff(result, variable), self.rules,
+                                             cache=self.cache, store=self.store)
+            else:
+                result = literal.Real(0.0)
+            self._derivatives[key[:index + 1]] = result
+        return result
+
+    def nth(self, variable: str, order: int) -> Expression:
+        """
+        Returns the n-th derivative with respect to a single variable
+        """
+        if order < 0:
+            raise ValueError(f"negative derivative order {order}")
+        return self.derivative(*[variable] * order)
+
+    def gradient(self, variables: Iterable[str]) -> list[Expression]:
+        return [self.derivative(variable) for variable in variables]
+
+    def hessian(self, variables: Iterable[str]) -> list[list[Expression]]:
+        """
+        Returns the matrix of second derivatives, each mixed partial is computed once and shared by both halves
+        """
+        variables = list(variables)
+        matrix = [[None] * len(variables) for _ in variables]
+        for row, first in enumerate(variables):
+            for column in range(row, len(variables)):
+                matrix[row][column] = matrix[column][row] = self.derivative(first, variables[column])
+        return matrix
+
+
+def nth_derivative(expression: Expression, variable: str, order: int, rules: list[Rule] | None = None) -> Expression:
+    """
+    Returns the simplified n-th derivative, differentiating the simplified derivative of each order in turn
+    """
+    return DerivativeTower(expression, rules).nth(variable, order)
+
+
+def hessian(expression: Expression, variables: Iterable[str], rules: list[Rule] | None = None) -> list[list[Expression]]:
+    """
+    Returns the simplified matrix of second derivatives, reusing the first derivatives and the symmetry
+    """
+    return DerivativeTower(expression, rules).hessian(variables)
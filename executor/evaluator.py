@@ -1,11 +1,14 @@
-import math
+import operator as op
 
-from executor.visitor import ExpressionVisitor
-from symbols.node import Expression, Node
-from symbols import literal, binary, unary, function
-from typing import Callable, Any
+from executor import autodiff
+from symbols.node import Expression, Node, fold
+from symbols import literal, binary, unary, function, operator, nary, tape as tapes
+from typing import Callable, Any, Mapping
 
 
+class EvaluatorError(RuntimeError):
+    pass
+
 
 def _interpret_visitor(node: Node, results: list[float]) -> float:
     match node:
@@ -27,25 +30,187 @@ def _interpret_visitor(node: Node, results: list[float]) -> float:
         case binary.Pow():
             return results[0] ** results[1]
 
+        case nary.NAry():
+            total = results[0]
+            for result in results[1:]:
+                total = node.combine(total, result)
+            return total
+
         case unary.Negate():
             return -results[0]
 
         case function.Sin():
-            return math.sin(results[0])
+            return autodiff.sin(results[0])
 
         case function.Cos():
-            return math.cos(results[0])
+            return autodiff.cos(results[0])
 
         case function.Exp():
-            return math.exp(results[0])
+            return autodiff.exp(results[0])
 
         case function.Log():
-            return math.log(results[0])
+            return autodiff.log(results[0])
 
         case _:
             raise TypeError(f"unsupported node type, {type(node)}")
 
 
+DIFF_BACKENDS = ('forward',)
+
+
+def evaluate(expression: Expression, env: Mapping[str, float], diff: str | None = 'forward') -> float:
+    """
+    Evaluates the expression with the variables bound to numbers (or numpy arrays)
+    :param expression: The expression
+    :param env: The variable names mapped to their values
+    :param diff: How to evaluate derivatives, 'forward' for forward mode automatic differentiation,
+        None to reject them (they can be expanded with simplify_expression beforehand instead)
+    :return: The value
+    """
+    if diff is not None and diff not in DIFF_BACKENDS:
+        raise EvaluatorError(f"unknown derivative backend '{diff}', backends = {DIFF_BACKENDS}")
+
+    def visit(node: Node, results: list[float]) -> float:
+        match node:
+            case literal.Variable():
+                if node.symbol not in env:
+                    raise EvaluatorError(f"unbound variable '{node.symbol}'")
+                return env[node.symbol]
+
+            case operator.Diff() if diff == 'forward':
+                return forward_derivative(node.expression, node.regard, env)[1]
+
+            case _:
+                return _interpret_visitor(node, results)
+
+    # derivatives evaluate their own expression
+    return fold(expression, visit, leaf=lambda node: isinstance(node, operator.Diff))
+
+
+def forward_derivative(expression: Expression, variable: str, env: Mapping[str, float]) -> tuple[float, float]:
+    """
+    Evaluates the expression and its derivative in a single traversal, with forward mode automatic
+    differentiation. Works with numpy arrays of values and nested derivatives
+    :param expression: The expression
+    :param variable: The variable to differentiate with respect to, must be bound
+    :param env: The variable names mapped to their values
+    :return: The value and the derivative
+    """
+    if variable not in env:
+        raise EvaluatorError(f"unbound variable '{variable}'")
+
+    tag = autodiff.next_tag()
+    seeded = dict(env)
+    seeded[variable] = autodiff.seed(env[variable], tag)
+    return autodiff.unseed(evaluate(expression, seeded), tag)
+
+
 def interpret_expression(expression: Expression) -> float:
-    visitor = ExpressionVisitor(_interpret_visitor)
-    return visitor.visit(expression)
+    return evaluate(expression, {}, diff=None)
+
+
+# the nodes that fold into a number once all of their children are numbers
+_foldable = (binary.Binary, nary.NAry, unary.Negate, function.Function)
+
+
+def partial_evaluate(expression: Expression, env: Mapping[str, float]) -> Expression:
+    """
+    Substitutes the bound variables and folds every subtree that becomes constant, in a single bottom up pass.
+    A derivative with its own variable bound is evaluated with forward mode when its expression is closed,
+    otherwise it is expanded symbolically before the variable is substituted
+    :param expression: The expression, which is not modified
+    :param env: The variable names mapped to their values, need not bind every variable
+    :return: The residual expression, sharing the untouched subtrees with the given one
+    """
+    def visit(node: Node, results: list[Expression]) -> Expression:
+        match node:
+            case literal.Variable() if node.symbol in env:
+                return literal.Real(env[node.symbol])
+
+            case operator.Diff() if node.regard in env:
+                if node.expression.free_variables <= env.keys():
+                    return literal.Real(forward_derivative(node.expression, node.regard, env)[1])
+
+                # the derivative at the bound value, imported here as the rules import the evaluator
+                from executor.simplify import simplify_expression
+                return partial_evaluate(simplify_expression(node), env)
+
+            case operator.Diff():
+                # only nested derivatives recurse
+                expression = partial_evaluate(node.expression, env)
+                return node if expression is node.expression else node.with_children([expression])
+
+            case _ if isinstance(node, _foldable) and all(isinstance(result, literal.Real) for result in results):
+                return literal.Real(_interpret_visitor(node, [result.number for result in results]))
+
+            case _ if all(result is child for result, child in zip(results, node.children)):
+                return node
+
+            case _:
+                return node.with_children(results)
+
+    return fold(expression, visit, leaf=lambda node: isinstance(node, operator.Diff))
+
+
+# the operations of the tape opcodes, by arity
+_tape_binary = {
+    tapes.OPCODES[binary.Add]: op.add,
+    tapes.OPCODES[binary.Sub]: op.sub,
+    tapes.OPCODES[binary.Mul]: op.mul,
+    tapes.OPCODES[binary.Div]: op.truediv,
+    tapes.OPCODES[binary.Pow]: op.pow,
+}
+_tape_unary = {
+    tapes.OPCODES[unary.Negate]: op.neg,
+    tapes.OPCODES[function.Sin]: autodiff.sin,
+    tapes.OPCODES[function.Cos]: autodiff.cos,
+    tapes.OPCODES[function.Exp]: autodiff.exp,
+    tapes.OPCODES[function.Log]: autodiff.log,
+}
+
+
+def evaluate_tape(tape: tapes.Tape, env: Mapping[str, float], root: int | None = None) -> float:
+    """
+    Evaluates a tape in a single pass over its arrays, the same as evaluate on the expression.
+    Derivatives are evaluated with forward mode automatic differentiation
+    :param tape: The tape
+    :param env: The variable names mapped to their values (or numpy arrays)
+    :param root: The entry to evaluate, the whole expression by default
+    :return: The value
+    """
+    if root is None:
+        root = len(tape) - 1
+        indices = range(root + 1)
+    else:
+        indices = tape.reachable(root)
+
+    opcodes, first, second = tape.opcodes, tape.first, tape.second
+    values: list[Any] = [None] * (root + 1)
+    for index in indices:
+        code = opcodes[index]
+        operation = _tape_binary.get(code)
+        if operation is not None:
+            values[index] = operation(values[first[index]], values[second[index]])
+            continue
+
+        operation = _tape_unary.get(code)
+        if operation is not None:
+            values[index] = operation(values[first[index]])
+        elif code == tapes.VARIABLE:
+            name = tape.names[first[index]]
+            if name not in env:
+                raise EvaluatorError(f"unbound variable '{name}'")
+            values[index] = env[name]
+        elif code == tapes.DIFF:
+            variable = tape.names[second[index]]
+            if variable not in env:
+                raise EvaluatorError(f"unbound variable '{variable}'")
+
+            tag = autodiff.next_tag()
+            seeded = dict(env)
+            seeded[variable] = autodiff.seed(env[variable], tag)
+            values[index] = autodiff.unseed(evaluate_tape(tape, seeded, first[index]), tag)[1]
+        else:
+            values[index] = tape.constants[first[index]]
+
+    return values[root]
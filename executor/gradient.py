@@ -0,0 +1,206 @@
+from typing import Any, Iterable, Mapping
+
+from executor import autodiff
+from executor.evaluator import EvaluatorError, _interpret_visitor
+from symbols import literal, binary, unary, function, nary
+from symbols.node import Expression, Node, postorder
+
+
+class _NumericAlgebra:
+    """
+    Adjoints as numbers (or numpy arrays), the node values are evaluated in a forward pass
+    """
+
+    values: dict[int, Any]
+
+    def __init__(self, order: list[Node], env: Mapping[str, Any]) -> None:
+        self.values = {}
+        for node in order:
+            if isinstance(node, literal.Variable):
+                if node.symbol not in env:
+                    raise EvaluatorError(f"unbound variable '{node.symbol}'")
+                value = env[node.symbol]
+            else:
+                value = _interpret_visitor(node, [self.values[id(child)] for child in node.children])
+            self.values[id(node)] = value
+
+    one = 1.0
+    zero = 0.0
+
+    def value(self, node: Node) -> Any:
+        return self.values[id(node)]
+
+    def constant(self, number: float) -> Any:
+        return number
+
+    @staticmethod
+    def add(a, b):
+        return a + b
+
+    @staticmethod
+    def sub(a, b):
+        return a - b
+
+    @staticmethod
+    def mul(a, b):
+        return a * b
+
+    @staticmethod
+    def div(a, b):
+        return a / b
+
+    @staticmethod
+    def pow(a, b):
+        return a ** b
+
+    @staticmethod
+    def neg(a):
+        return -a
+
+    sin = staticmethod(autodiff.sin)
+    cos = staticmethod(autodiff.cos)
+    log = staticmethod(autodiff.log)
+
+
+class _SymbolicAlgebra:
+    """
+    Adjoints as expressions, which refer to the subtrees of the differentiated expression rather than copies
+    """
+
+    def __init__(self) -> None:
+        self.one = literal.Real(1.0)
+        self.zero = literal.Real(0.0)
+
+    def value(self, node: Node) -> Expression:
+        return node
+
+    def constant(self, number: float) -> Expression:
+        return literal.Real(number)
+
+    def add(self, a, b):
+        return binary.Add(a, b)
+
+    def sub(self, a, b):
+        return binary.Sub(a, b)
+
+    def mul(self, a, b):
+        # the seed adjoint is one, so skip the trivial products
+        if a is self.one:
+            return b
+        if b is self.one:
+            return a
+        return binary.Mul(a, b)
+
+    def div(self, a, b):
+        return binary.Div(a, b)
+
+    def pow(self, a, b):
+        return binary.Pow(a, b)
+
+    def neg(self, a):
+        return unary.Negate(a)
+
+    def sin(self, a):
+        return function.Sin(a)
+
+    def cos(self, a):
+        return function.Cos(a)
+
+    def log(self, a):
+        return function.Log(a)
+
+
+def _partials(node: Node, algebra: Any, wanted: frozenset[str]) -> list[Any]:
+    # the derivatives of the node with respect to each of its children, the wanted variables are the ones to compute
+    values = [algebra.value(child) for child in node.children]
+    match node:
+        case binary.Add():
+            return [algebra.one, algebra.one]
+        case binary.Sub():
+            return [algebra.one, algebra.constant(-1.0)]
+        case binary.Mul():
+            return [values[1], values[0]]
+        case binary.Div():
+            left, right = values
+            return [
+                algebra.div(algebra.one, right),
+                algebra.neg(algebra.div(left, algebra.mul(right, right)))
+            ]
+        case binary.Pow():
+            base, exponent = values
+            partials = [algebra.mul(exponent, algebra.pow(base, algebra.sub(exponent, algebra.one)))]
+            # the log term is only needed for exponents of the wanted variables, and fails on negative bases
+            if not wanted.isdisjoint(node.right.free_variables):
+                partials.append(algebra.mul(algebra.value(node), algebra.log(base)))
+            else:
+                partials.append(algebra.zero)
+            return partials
+        case nary.Sum():
+            return [algebra.one] * len(values)
+        case nary.Product():
+            # the product of the other operands, from the products before and after each of them
+            before = [algebra.one]
+            for value in values[:-1]:
+                before.append(algebra.mul(before[-1], value))
+            partials = []
+            after = algebra.one
+            for index in range(len(values) - 1, -1, -1):
+                partials.append(algebra.mul(before[index], after))
+                after = algebra.mul(values[index], after)
+            partials.reverse()
+            return partials
+        case unary.Negate():
+            return [algebra.constant(-1.0)]
+        case function.Sin():
+            return [algebra.cos(values[0])]
+        case function.Cos():
+            return [algebra.neg(algebra.sin(values[0]))]
+        case function.Exp():
+            return [algebra.value(node)]
+        case function.Log():
+            return [algebra.div(algebra.one, values[0])]
+        case _:
+            raise TypeError(f"unsupported node type, {type(node)}")
+
+
+def gradient(expression: Expression, variables: Iterable[str], env: Mapping[str, Any] | None = None) -> list[Any]:
+    """
+    Computes the partial derivatives with respect to all the variables in a single reverse sweep.
+    Derivative nodes are not supported, expand them with simplify_expression first
+    :param expression: The expression
+    :param variables: The variables to differentiate with respect to
+    :param env: The variable values to evaluate the gradient at, None for symbolic derivatives
+    :return: The derivatives in the order of the variables, numbers (or numpy arrays) when env is given,
+        otherwise unsimplified expressions sharing the subtrees of the expression
+    """
+    if expression.has_diff:
+        raise EvaluatorError("cannot take the gradient of unexpanded derivatives")
+
+    variables = list(variables)
+    wanted = frozenset(variables)
+
+    # only the subtrees containing the variables need adjoints
+    order = list(postorder(expression))
+    algebra = _SymbolicAlgebra() if env is None else _NumericAlgebra(order, env)
+
+    adjoints: dict[int, Any] = {id(expression): algebra.one}
+    totals: dict[str, Any] = {}
+    for node in reversed(order):
+        adjoint = adjoints.pop(id(node), None)
+        if adjoint is None:
+            continue
+
+        if isinstance(node, literal.Variable):
+            total = totals.get(node.symbol)
+            totals[node.symbol] = adjoint if total is None else algebra.add(total, adjoint)
+            continue
+
+        for child, partial in zip(node.children, _partials(node, algebra, wanted)):
+            if partial is algebra.zero or wanted.isdisjoint(child.free_variables):
+                continue
+
+            contribution = algebra.mul(adjoint, partial)
+            existing = adjoints.get(id(child))
+            adjoints[id(child)] = contribution if existing is None else algebra.add(existing, contribution)
+
+    return [totals.get(variable, algebra.zero) for variable in variables]
@@ -1,12 +1,17 @@
 import abc
-import queue
+import logging
+from typing import Callable
 
-from symbols import Expression
+from symbols.cache import LRUCache
+from symbols import Expression, Node
+from symbols.intern import NodeFactory
+from symbols.node import fold
 
 
 class Rule(abc.ABC):
     weight: float = 0.0  # the higher the weighting, the more quickly it applies
     id: int = 0  # custom id to order
+    types: tuple[type[Node], ...] | None = None  # the node classes the rule can match, None for any
 
     item: int = 0  # the subnumber of the rule that matched, optionally used to keep state
 
@@ -32,18 +37,28 @@ class Rule(abc.ABC):
         pass
 
 
-# a generic rule applier class
-class RuleApplier:
-    rules: list[Rule]
+logger = logging.getLogger(__name__)
 
-    # checking for loops
-    depth: str  # the depth id for the operation
-    logs: list[str]  # the list of depth/rules
 
-    MAX_LOOP_SIZE = 20
+# canonical rule set keys, so that normal form markers can be compared by identity
+_rule_set_keys: dict[tuple[type, ...], tuple[type, ...]] = {}
 
-    def __init__(self, rules: list[Rule]):
+
+# a generic rule applier class
+class RuleApplier:
+    rules: list[Rule]
+    factory: NodeFactory | None  # when given, rewritten nodes are interned into shared frozen nodes
+    cache: LRUCache | None  # when given, maps (rule set, subtree) to whether it changed and the rewritten subtree
+    key: tuple[type, ...]  # identifies the rule set in the cache
+    dispatch: dict[type[Node], list[Rule]]  # the rules that can match each node class, in order
+    on_loop: Callable[[Expression, Rule], None]  # called with the expression and the rule that revisits a state
+
+    def __init__(self, rules: list[Rule], factory: NodeFactory | None = None, cache: LRUCache | None = None,
+                 on_loop: Callable[[Expression, Rule], None] | None = None):
         self.rules = rules
+        self.factory = factory
+        self.cache = cache
+        self.on_loop = on_loop if on_loop is not None else self.log_loop
         self.prepare()
 
     def order_rules(self):
@@ -51,96 +66,172 @@ class RuleApplier:
         for i, r in enumerate(rules):
             r.id = i
         self.rules = rules
+        key = tuple(type(r) for r in rules)
+        self.key = _rule_set_keys.setdefault(key, key)
+        self.build_dispatch()
+
+    def build_dispatch(self):
+        self.dispatch = {}
+
+        # index every known node class up front, unseen classes are added on first use
+        classes = [Node]
+        while classes:
+            cls = classes.pop()
+            self.rules_for(cls)
+            classes.extend(cls.__subclasses__())
+
+    def rules_for(self, cls: type[Node]) -> list[Rule]:
+        rules = self.dispatch.get(cls)
+        if rules is None:
+            rules = [rule for rule in self.rules if rule.types is None or issubclass(cls, rule.types)]
+            self.dispatch[cls] = rules
+        return rules
 
     def prepare(self):
         self.order_rules()
-        self.depth = ''
-        # self.logs = ['7', '9', '4', '7', '9']
-        self.logs = []
-
-    def __addlog(self, depth: str, rule: int):
-        if len(self.logs) >= self.MAX_LOOP_SIZE:
-            self.logs.pop(0)
-
-        self.logs.append(f"{depth}_{rule}")
-
-    def __poplog(self):
-        self.logs.pop()
-
-    def __isrepeated(self):
-        # check for repeats, only accepts loop of size >= 2
-        # O(n^2) lmao
-        size = len(self.logs)
-        for loopsize in range(2, size // 2 + 1):
-            for i in range(size - 2 * loopsize + 1):
-                s1 = self.logs[i:i + loopsize]
-                s2 = self.logs[i + loopsize: i + 2 * loopsize]
-
-                # check for slice equality
-                for i in range(len(s1)):
-                    if s1[i] != s2[i]:
-                        break
-                else:
-                    return True
-        return False
 
-    def __logloop(self, verbose: bool = True):
-        print(f"Warning: found loop {self.logs}")
-        # print extra
-        if verbose:
-            names = []
-            for log in self.logs:
-                depth, rule_i = log.split('_')
-                rule = self.rules[int(rule_i)]
-                names.append(f"({type(rule).__name__}) {depth}")
+    @staticmethod
+    def log_loop(expression: Expression, rule: Rule):
+        logger.warning("found loop on %s, skipped (%s)", expression.as_display(), type(rule).__name__)
+
+    def __build(self, expression: Expression) -> Expression:
+        if self.factory is None:
+            return expression
+        return self.factory.intern(expression)
+
+    def __lookup(self, expression: Expression) -> tuple[bool, Expression] | None:
+        # subtrees already at a fixpoint of this rule set, usually left untouched by a rewrite above
+        if expression.normal_under is self.key:
+            return False, expression
+
+        if self.cache is not None:
+            cached = self.cache.get((self.key, expression))
+            if cached is not None:
+                changed, result = cached
+                if not changed:
+                    # keep the caller's node, rebuilding the parents of equal nodes would be wasted work
+                    expression.normal_under = self.key
+                    return False, expression
+                return True, self.__build(result)
+
+        return None
+
+    def __step(self, frame: '_Frame') -> bool:
+        # whether any change is made
+        matched = False
+        current = frame.current
+
+        # apply changes by rebuilding the node, and check for changes
+        if any(modified for modified, _ in frame.results):
+            matched = True
+            current = self.__build(current.with_children(
+                [new_child for _, new_child in frame.results]
+            ))
+            frame.seen.add(current)
+
+        # try to apply the rules on the node
+        for rule in self.rules_for(current.__class__):
+            if rule.match(current):
+                rewritten = self.__build(rule.apply(current))
+
+                # skip the rule if it returns to an earlier state
+                if rewritten in frame.seen:
+                    self.on_loop(current, rule)
+                    break
+
+                frame.seen.add(rewritten)
+                matched = True
+                current = rewritten
+                # also break the entire loop, for the children must be rescanned
+                break
+
+        frame.current = current
+        return matched
 
-            print(f"Verbose: [ {', '.join(names)} ]")
+    def __finish(self, frame: '_Frame') -> tuple[bool, Expression]:
+        current = frame.current
+        current.normal_under = self.key
+        if self.cache is not None:
+            self.cache.put((self.key, frame.expression), (frame.changed, current))
+            if frame.changed:
+                self.cache.put((self.key, current), (False, current))
+
+        return frame.changed, current
 
     def apply(self, expression: Expression) -> tuple[bool, Expression]:
-        current = expression  # the modified expression
-        changed = False  # whether the expression has changed
+        """
+        Rewrites the expression until no rule matches, the expression itself is never modified.
+        The tree is walked with an explicit stack of frames, so any depth can be rewritten
+        :param expression: The expression
+        :return: Whether any rule applied, and the rewritten expression
+        """
+        if self.cache is None or self.factory is not None:
+            return self.__rewrite(expression)
 
-        # keep applying rules on the expression
-        while True:
-            # whether any change is made
-            matched = False
+        # the cached trees are shared by every caller, so the result is handed out as a copy of its nodes that are
+        # not frozen. The nodes of the expression in the cache are part of its key as well, modifying them makes a miss
+        changed, result = self.__rewrite(expression)
+        return (True, _detach(result)) if changed else (False, expression)
 
-            # apply rules on children
-            result = []
-            for index, child in enumerate(current.children):
-                # add depth
-                self.depth = f"{self.depth}{index}"
-                result.append(self.apply(child))
-                # remove depth
-                self.depth = self.depth[:-1]
-
-            # apply changes, and check for changes
-            for index, res in enumerate(result):
-                modified, new_child = res
-                if modified:
-                    matched = True
-                    current.children[index] = new_child
-
-            # try to apply the rules on the node
-            for rule in self.rules:
-                if rule.match(current):
-
-                    # check for loops
-                    self.__addlog(self.depth, rule.id)
-                    if self.__isrepeated():  # skip the rule if found a loop
-                        self.__logloop()
-                        self.__poplog()
-                        break
-
-                    matched = True
-                    current = rule.apply(current)
-                    # also break the entire loop, for the children must be rescanned
-                    break
+    def __rewrite(self, expression: Expression) -> tuple[bool, Expression]:
+        done = self.__lookup(expression)
+        if done is not None:
+            return done
 
-            # any changes means changed is true, no changes means exit
-            if matched:
-                changed = True
-            else:
-                break
+        stack = [_Frame(expression, self.__build(expression))]
+        while True:
+            frame = stack[-1]
 
-        return changed, current
+            # apply rules on children
+            children = frame.current.children
+            if len(frame.results) < len(children):
+                child = children[len(frame.results)]
+                done = self.__lookup(child)
+                if done is None:
+                    stack.append(_Frame(child, self.__build(child)))
+                else:
+                    frame.results.append(done)
+                continue
+
+            # keep applying rules on the expression, rescanning the children after any change
+            if self.__step(frame):
+                frame.changed = True
+                frame.results = []
+                continue
+
+            stack.pop()
+            done = self.__finish(frame)
+            if not stack:
+                return done
+            stack[-1].results.append(done)
+
+
+def _detach(expression: Expression) -> Expression:
+    # a copy of the nodes that are not frozen keeping their normal form markers, the frozen subtrees are shared
+    def copy(node: Node, children: list[Node]) -> Node:
+        if node.frozen:
+            return node
+        result = node.with_children(children)
+        result.normal_under = node.normal_under
+        return result
+
+    return fold(expression, copy, leaf=lambda node: node.frozen)
+
+
+class _Frame:
+    """
+    The state of RuleApplier.apply at one position of the tree
+    """
+
+    expression: Expression  # the original expression
+    current: Expression  # the modified expression
+    changed: bool  # whether the expression has changed
+    seen: set[Expression]  # the states of the expression at this position, to detect rewrite loops
+    results: list[tuple[bool, Expression]]  # the rewritten children so far
+
+    def __init__(self, expression: Expression, current: Expression) -> None:
+        self.expression = expression
+        self.current = current
+        self.changed = False
+        self.seen = {current}
+        self.results = []
@@ -1,6 +1,7 @@
 from executor.rule import Rule
 from executor.rules.simple import contains_variable
-from symbols import Expression, literal, operator, binary, unary, function
+from symbols import Expression, literal, operator, binary, unary, function, nary
+from symbols.polynomial import Polynomial, expandable
 
 
 ### differential rules ###
@@ -8,6 +9,7 @@ from symbols import Expression, literal, operator, binary, unary, function
 # differentiate constants
 class ConstantRule(Rule):
     weight = 10.0
+    types = (operator.Diff,)
 
     def match(self, expression: Expression) -> bool:
         match expression:
@@ -23,6 +25,7 @@ class ConstantRule(Rule):
 # differentiates arithmetic operations
 class ArithmeticRule(Rule):
     weight = 9.0
+    types = (operator.Diff,)
 
     def match(self, expression: Expression) -> bool:
         match expression:
@@ -32,7 +35,7 @@ class ArithmeticRule(Rule):
                 # multiplication and division rule
                 # negate rule
                 match expression.expression:
-                    case binary.Add() | binary.Sub() | binary.Mul() | binary.Div() | unary.Negate():
+                    case binary.Add() | binary.Sub() | binary.Mul() | binary.Div() | unary.Negate() | nary.NAry():
                         return True
                     case _:
                         return False
@@ -85,6 +88,15 @@ class ArithmeticRule(Rule):
                         literal.Real(2)
                     )
                 )
+            case nary.Sum():
+                return nary.Sum(*(operator.Diff(term, expression.regard) for term in inner.children))
+            case nary.Product():
+                # the product rule, each operand differentiated in turn
+                factors = inner.children
+                return nary.Sum(*(
+                    nary.Product(*factors[:index], *factors[index + 1:], operator.Diff(factor, expression.regard))
+                    for index, factor in enumerate(factors)
+                ))
 
             case _:
                 raise Exception("not matched, this should never happen")
@@ -93,6 +105,7 @@ class ArithmeticRule(Rule):
 # differentiate powers and exponentials
 class PowerRule(Rule):
     weight = 9.0
+    types = (operator.Diff,)
 
     POW_RULE = 2
     CONSTANT_RULE = 1
@@ -127,20 +140,44 @@ class PowerRule(Rule):
                 operator.Diff(inner.left, expression.regard)
             )
 
-        # returns the ln version
+        # returns the ln version, a ^ b = exp(b * log a)
         return operator.Diff(
             function.Exp(
                 binary.Mul(
-                    inner.left,
-                    function.Log(inner.right)
+                    inner.right,
+                    function.Log(inner.left)
                 )
             ),
             expression.regard
         )
 
 
+# differentiates polynomials of a high degree in one step, rather than term by term
+class PolynomialRule(Rule):
+    weight = 9.5
+    types = (operator.Diff,)
+
+    min_degree = 4  # lower degrees are left to the arithmetic rules
+    max_terms = 1 << 12  # expansions beyond this are left to the arithmetic rules
+    max_variables = 16  # polynomials of more variables are left to the arithmetic rules
+
+    def match(self, expression: Expression) -> bool:
+        # only the cached bounds are checked, those matched always expand, so the arithmetic rules never split
+        # a failed expansion into parts that are tried again
+        match expression:
+            case operator.Diff():
+                return expandable(expression.expression, self.min_degree, self.max_terms, self.max_variables)
+            case _:
+                return False
+
+    def apply(self, expression: Expression) -> Expression:
+        # integer coefficients are kept exact
+        return Polynomial.from_node(expression.expression).diff(expression.regard).to_node(exact=True)
+
+
 class ExpLogRule(Rule):
     weight = 9.0
+    types = (operator.Diff,)
 
     EXP_RULE = 1
     LOG_RULE = 2
@@ -180,6 +217,7 @@ class ExpLogRule(Rule):
 
 class TrigRule(Rule):
     weight = 9.0
+    types = (operator.Diff,)
 
     SIN_RULE = 1
     COSINE_RULE = 2
@@ -215,4 +253,4 @@ class TrigRule(Rule):
                 )
 
 
-diffrules = [ConstantRule(), ArithmeticRule(), PowerRule(), ExpLogRule(), TrigRule()]
+diffrules = [ConstantRule(), PolynomialRule(), ArithmeticRule(), PowerRule(), ExpLogRule(), TrigRule()]
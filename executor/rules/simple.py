@@ -1,35 +1,22 @@
 from executor.evaluator import interpret_expression
 from executor.rule import Rule
-from executor.visitor import ExpressionVisitor
-from symbols import Expression, literal, unary, binary
-from symbols.operator import Diff
-from symbols.literal import Variable
+from symbols import Expression, literal, unary, binary, function, nary
 
 
 def contains_variable(expression: Expression, symbol: str | None = None) -> bool:
-    visitor = ExpressionVisitor(
-        lambda node, results:
-        True
-        if any(results)
-        else isinstance(node, Variable) and (symbol is None or node.symbol == symbol)
-    )
-    return visitor.visit(expression)
+    if symbol is None:
+        return bool(expression.free_variables)
+    return symbol in expression.free_variables
 
 
 def contains_unevallable(expression: Expression) -> bool:
-    blacklist = (Variable, Diff,)
-    visitor = ExpressionVisitor(
-        lambda node, results:
-        True
-        if any(results)
-        else isinstance(node, blacklist)
-    )
-    return visitor.visit(expression)
+    return not expression.is_constant
 
 
 # evaluate any evaluable expression
 class EvaluateRule(Rule):
     weight = 10.0
+    types = (binary.Binary, nary.NAry, function.Function, unary.Negate)
 
     def match(self, expression: Expression) -> bool:
         match expression:
@@ -46,6 +33,7 @@ class EvaluateRule(Rule):
 # remove identities
 class IdentityRule(Rule):
     weight = 10.0
+    types = (binary.Pow, binary.Mul, binary.Add, binary.Sub, binary.Div, nary.NAry)
 
     POW_SIMP = 1
     MUL_SIMP = 2
@@ -54,6 +42,8 @@ class IdentityRule(Rule):
     SUB_SIMP_R = 5
     SUB_SIMP_V = 6
     DIV_SIMP_V = 7
+    NARY_SIMP = 8
+    PRODUCT_SIMP = 9
 
     def match(self, expression: Expression) -> bool:
         match expression:
@@ -83,6 +73,14 @@ class IdentityRule(Rule):
                 self.setitem(self.SUB_SIMP_V)
                 return True
 
+            # n-ary nodes fold their constants and drop the identity themselves
+            case nary.NAry() if len(expression.children) == 1:
+                self.setitem(self.NARY_SIMP)
+                return True
+            case nary.Product() if isinstance(first := expression.children[0], literal.Real) and first.number == 0.0:
+                self.setitem(self.PRODUCT_SIMP)
+                return True
+
             case binary.Div() if type(expression.left) == type(expression.right):
                 match expression.left:
                     case literal.Variable() if expression.left.symbol == expression.right.symbol:
@@ -125,6 +123,11 @@ class IdentityRule(Rule):
             case self.DIV_SIMP_V:
                 return literal.Real(1.0)
 
+            case self.NARY_SIMP:
+                return expression.children[0]
+            case self.PRODUCT_SIMP:
+                return literal.Real(0)
+
 
 # puts the multiplication constant on the left
 # class LeftConstant(Rule):
@@ -147,6 +150,7 @@ class IdentityRule(Rule):
 # Rule to combine the communicative operators
 class CombineRule(Rule):
     weight = 5.0
+    types = (binary.Add, binary.Sub, binary.Mul, binary.Div)
 
     COM_RULE_L = 1
     COM_RULE_R = 2
@@ -197,6 +201,7 @@ class CombineRule(Rule):
 # with reals the most left, followed by variables
 class ReorderRule(Rule):
     weight = 6.0
+    types = (binary.Add, binary.Mul)
 
     def match(self, expression: Expression) -> bool:
         match expression:
@@ -229,6 +234,7 @@ class ReorderRule(Rule):
 # improve the tree structure to be left aligned
 class LeftAlignRule(Rule):
     weight = 7.0
+    types = (binary.Add, binary.Sub, binary.Mul, binary.Div)
 
     LB_RULE = 1
 
@@ -262,6 +268,7 @@ class LeftAlignRule(Rule):
 # Division hosting over multiplication
 class HoistDivision(Rule):
     weight = 9.0
+    types = (binary.Mul,)
 
     def match(self, expression: Expression) -> bool:
         # [[A / B] * C] => [[A * C] / B]
@@ -279,6 +286,7 @@ class HoistDivision(Rule):
 
 class CancelRule(Rule):
     weight = 8.0
+    types = (binary.Sub, binary.Div)
 
     SUB_RULE = 1
     DIV_RULE = 2
@@ -306,23 +314,23 @@ class CancelRule(Rule):
                 return False
 
     def apply(self, expression: Expression) -> Expression:
-        new_expression = expression.left
-
-        left = new_expression
-
         match self.item:
             case self.SUB_RULE:
-                while isinstance(left, binary.Add):
-                    if isinstance(left.right, literal.Variable) and left.right.symbol == expression.right.symbol:
-                        # replace left.right
-                        left.right = literal.Real(0.0)
-                        break
-            case self.DIV_RULE:
-                while isinstance(left, binary.Mul):
-                    if isinstance(left.right, literal.Variable) and left.right.symbol == expression.right.symbol:
-                        # replace left.right
-                        left.right = literal.Real(1.0)
-                        break
+                chain, identity = binary.Add, literal.Real(0.0)
+            case _:
+                chain, identity = binary.Mul, literal.Real(1.0)
+
+        # walk down the chain to the cancelled variable
+        spine = []
+        left = expression.left
+        while not (isinstance(left.right, literal.Variable) and left.right.symbol == expression.right.symbol):
+            spine.append(left)
+            left = left.left
+
+        # rebuild the chain upwards rather than modifying the (possibly shared) nodes
+        new_expression = chain(left.left, identity)
+        for node in reversed(spine):
+            new_expression = chain(new_expression, node.right)
 
         return new_expression
 
@@ -1,10 +1,29 @@
+from executor.cache import simplify_cache
 from executor.rule import Rule, RuleApplier
 from executor.rules.diff import diffrules
 from executor.rules.simple import EvaluateRule, simplerules
-from symbols import Expression, literal
+from executor.store import ResultStore, rule_fingerprint
+from symbols.cache import LRUCache
+from symbols import Expression, literal, nary, polynomial
+from symbols.intern import NodeFactory
 
 
-def simplify_expression(expression: Expression, rules: list[Rule] | None = None) -> Expression:
+def simplify_expression(expression: Expression, rules: list[Rule] | None = None,
+                        factory: NodeFactory | None = None,
+                        cache: LRUCache | None = simplify_cache,
+                        store: ResultStore | None = None) -> Expression:
+    """
+    Simplifies the expression with the simple and differentiation rules, followed by the given rules.
+    The polynomial subtrees of a high degree that expand into no more terms than they have leaves are expanded first,
+    and the operands of the sums and products come out in the canonical order of symbols.nary
+    :param expression: The expression, which is not modified
+    :param rules: The extra rules
+    :param factory: The factory to intern the rewritten nodes with, if any
+    :param cache: The cache of simplified subtrees, the process wide cache by default, None to disable.
+        The results are copies of the cached trees, so they can be modified
+    :param store: The persistent store of simplified expressions, looked up before any rewriting
+    :return: The simplified expression
+    """
     if rules is None:
         rules = []
 
@@ -14,5 +33,22 @@ def simplify_expression(expression: Expression, rules: list[Rule] | None = None)
         *rules
     ]
 
-    rule_applier = RuleApplier(applied_rules)
-    return rule_applier.apply(expression)[1]
+    if store is not None:
+        fingerprint = rule_fingerprint(applied_rules)
+        result = store.get(fingerprint, expression)
+        if result is not None:
+            return factory.intern(result) if factory is not None else result
+
+    rule_applier = RuleApplier(applied_rules, factory, cache)
+    if expression.normal_under is rule_applier.key:
+        return expression
+
+    # the sum and product chains are flattened, folded and sorted in one pass before and after the rules, rather than
+    # rotated into order by the rules a step at a time. The rules run again on the sorted result, so it stays a fixpoint
+    result = polynomial.expand_polynomials(expression)
+    result = rule_applier.apply(nary.to_binary(nary.canonicalize(result)))[1]
+    result = rule_applier.apply(nary.to_binary(nary.canonicalize(result)))[1]
+
+    if store is not None:
+        store.put(fingerprint, expression, result)
+    return result
@@ -0,0 +1,205 @@
+import hashlib
+import inspect
+import os
+import sqlite3
+import sys
+
+import executor
+import symbols
+from executor.rule import Rule
+from symbols import Expression
+from symbols.serialize import to_bytes, from_bytes
+
+# bumped whenever the stored encoding changes
+FORMAT_VERSION = 2
+
+_fingerprints: dict[tuple[type, ...], str] = {}
+
+# the packages the rules and their results depend on, the nodes, the applier, the evaluator and so on
+_packages = (symbols, executor)
+_package_digest: bytes | None = None
+
+
+def _package_sources() -> bytes:
+    # the digest of every source file of the packages, computed once
+    global _package_digest
+    if _package_digest is None:
+        digest = hashlib.sha256()
+        for package in _packages:
+            for directory in package.__path__:
+                for root, directories, files in os.walk(directory):
+                    directories.sort()
+                    for name in sorted(files):
+                        if name.endswith('.py'):
+                            path = os.path.join(root, name)
+                            digest.update(f"{package.__name__}/{os.path.relpath(path, directory)}\n".encode())
+                            with open(path, 'rb') as file:
+                                digest.update(file.read())
+        _package_digest = digest.digest()
+    return _package_digest
+
+
+def rule_fingerprint(rules: list[Rule]) -> str:
+    """
+    Returns a digest of the rule set, the rule classes, the source of the modules defining them and of the symbols
+    and executor packages, so any change of the rules or the code they use gives a new fingerprint
+    :param rules: The rules
+    :return: The hex digest
+    """
+    key = tuple(type(r) for r in rules)
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is not None:
+        return fingerprint
+
+    digest = hashlib.sha256(f"format {FORMAT_VERSION}\n".encode())
+    digest.update(_package_sources())
+    modules = {}
+    for cls in sorted(set(key), key=lambda c: (c.__module__, c.__qualname__)):
+        digest.update(f"{cls.__module__}.{cls.__qualname__}\n".encode())
+        modules[cls.__module__] = sys.modules[cls.__module__]
+
+    # the modules of the rules defined outside the packages
+    packages = {package.__name__ for package in _packages}
+    for name in sorted(modules):
+        if name.split('.')[0] in packages:
+            continue
+        try:
+            source = inspect.getsource(modules[name])
+        except (OSError, TypeError):  # rules defined without a source file, only their names count
+            continue
+        digest.update(source.encode())
+
+    fingerprint = _fingerprints[key] = digest.hexdigest()
+    return fingerprint
+
+
+class ResultStore:
+    """
+    A persistent mapping of expressions to their simplified forms, kept in an SQLite database in a directory.
+    Entries are keyed by the binary encoding of the input together with the rule set fingerprint, so results of
+    changed rules are never returned, they age out of the store as the least recently used
+    """
+
+    FILENAME = 'results.sqlite'
+
+    path: str
+    max_entries: int  # the least recently used entries beyond this are evicted
+    hits: int
+    misses: int
+
+    _connection: sqlite3.Connection
+    _count: int  # the number of entries
+    _clock: int  # the last use stamp, processes sharing the store keep their own so the order is approximate
+    _touched: list[tuple[int, str, bytes]]  # the use stamps of the hits not written yet
+
+    def __init__(self, directory: str, max_entries: int = 1 << 20) -> None:
+        if max_entries <= 0:
+            raise ValueError(f"store size must be positive, max_entries = {max_entries}")
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, self.FILENAME)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # several processes may share the store
+        self._connection = sqlite3.connect(self.path, timeout=30.0)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'fingerprint TEXT NOT NULL, input BLOB NOT NULL, output BLOB NOT NULL, used INTEGER NOT NULL, '
+            'PRIMARY KEY (fingerprint, input))'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self._connection.commit()
+
+        self._count, self._clock = self._connection.execute(
+            'SELECT COUNT(*), COALESCE(MAX(used), 0) FROM results'
+        ).fetchone()
+        self._touched = []
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> 'ResultStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def get(self, fingerprint: str, expression: Expression) -> Expression | None:
+        """
+        Returns the stored result of the expression under the rule set, None if there is none
+        """
+        key = to_bytes(expression)
+        row = self._connection.execute(
+            'SELECT output FROM results WHERE fingerprint = ? AND input = ?', (fingerprint, key)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._clock += 1
+        self._touched.append((self._clock, fingerprint, key))
+        if len(self._touched) >= 256:
+            self.flush()
+        return from_bytes(row[0])
+
+    def put(self, fingerprint: str, expression: Expression, result: Expression) -> None:
+        """
+        Stores the result of the expression under the rule set
+        """
+        self._clock += 1
+        key, output = to_bytes(expression), to_bytes(result)
+        cursor = self._connection.execute(
+            'INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)', (fingerprint, key, output, self._clock)
+        )
+        if cursor.rowcount:
+            self._count += 1
+        else:
+            # only new keys are counted
+            self._connection.execute(
+                'UPDATE results SET output = ?, used = ? WHERE fingerprint = ? AND input = ?',
+                (output, self._clock, fingerprint, key)
+            )
+        if self._count > self.max_entries:
+            self._evict()
+        # write transactions are kept short, as they lock out the other processes sharing the store
+        self._connection.commit()
+
+    def _evict(self) -> None:
+        # evict a tenth at a time, so the deletes are amortized
+        self.flush()
+        self._count = self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+
+        excess += self.max_entries // 10
+        self._connection.execute(
+            'DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)', (excess,)
+        )
+        self._count = max(self._count - excess, 0)
+
+    def flush(self) -> None:
+        """
+        Writes the use stamps of the hits, which are batched
+        """
+        if self._touched:
+            self._connection.executemany(
+                'UPDATE results SET used = ? WHERE fingerprint = ? AND input = ?', self._touched
+            )
+            self._touched = []
+        self._connection.commit()
+
+    def clear(self) -> None:
+        self._touched = []
+        self._connection.execute('DELETE FROM results')
+        self._connection.commit()
+        self._count = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,126 @@
+from typing import Any, Mapping
+
+from executor.evaluator import EvaluatorError
+from symbols import literal, binary, unary, function, nary
+from symbols.node import Expression, Node, postorder
+
+try:
+    import numpy as np
+except ImportError:  # numpy is an optional dependency, only needed here
+    np = None
+
+
+def _ufuncs() -> dict[type[Node], Any]:
+    return {
+        binary.Add: np.add,
+        binary.Sub: np.subtract,
+        binary.Mul: np.multiply,
+        binary.Div: np.divide,
+        binary.Pow: np.power,
+        nary.Sum: np.add,
+        nary.Product: np.multiply,
+        unary.Negate: np.negative,
+        function.Sin: np.sin,
+        function.Cos: np.cos,
+        function.Exp: np.exp,
+        function.Log: np.log,
+    }
+
+
+def _apply(ufunc: Any, operands: list[Any], out: Any = None) -> Any:
+    # the n-ary nodes apply their binary ufunc pairwise into the output, a single operand is copied
+    if len(operands) == ufunc.nin:
+        return ufunc(*operands, out=out)
+    if len(operands) == 1:
+        return np.positive(operands[0], out=out)
+
+    result = ufunc(operands[0], operands[1], out=out)
+    for operand in operands[2:]:
+        result = ufunc(result, operand, out=out)
+    return result
+
+
+def evaluate_array(expression: Expression, env: Mapping[str, Any], out: Any = None) -> Any:
+    """
+    Evaluates the expression elementwise over arrays of variable values, with numpy broadcasting.
+    Intermediate results are written into a small pool of scratch buffers, which are reused once consumed,
+    and equal subtrees are computed once
+    :param expression: The expression
+    :param env: The variable names mapped to arrays (or scalars) of their values
+    :param out: The array to write the result into, if any
+    :return: The array of values, of the broadcast shape of the variables
+    """
+    if np is None:
+        raise EvaluatorError("numpy is required for evaluate_array")
+
+    ufuncs = _ufuncs()
+    arrays = {name: np.asarray(value, dtype=np.float64) for name, value in env.items()}
+    shape = np.broadcast_shapes(*(array.shape for array in arrays.values()))
+
+    # the distinct subtrees, children first, and the number of parents using each of them
+    order = []
+    uses: dict[Node, int] = {}
+    for node in postorder(expression, lambda n: n in uses):
+        if node in uses:
+            continue
+        uses[node] = 0
+        order.append(node)
+        for child in node.children:
+            uses[child] += 1
+
+    values: dict[Node, Any] = {}  # the computed values, scalars, input arrays or scratch buffers
+    scratch: set[int] = set()  # the ids of the scratch buffers in use
+    pool: list[Any] = []  # the free scratch buffers
+
+    def release(node: Node):
+        uses[node] -= 1
+        if not uses[node]:
+            value = values.pop(node)
+            if id(value) in scratch:
+                scratch.remove(id(value))
+                pool.append(value)
+
+    for node in order:
+        match node:
+            case literal.Real():
+                values[node] = float(node.number)
+
+            case literal.Variable():
+                if node.symbol not in arrays:
+                    raise EvaluatorError(f"unbound variable '{node.symbol}'")
+                values[node] = arrays[node.symbol]
+
+            case _:
+                ufunc = ufuncs.get(node.__class__)
+                if ufunc is None:
+                    raise TypeError(f"unsupported node type, {type(node)}")
+
+                operands = [values[child] for child in node.children]
+                # the partial results of longer n-ary nodes would overwrite the operands still to read
+                early = len(operands) <= 2
+                if early:
+                    for child in node.children:
+                        release(child)
+
+                if all(np.ndim(operand) == 0 for operand in operands):
+                    # constant subtrees stay scalars
+                    values[node] = _apply(ufunc, operands)[()]
+                else:
+                    # write into a released buffer, possibly an operand consumed for the last time
+                    buffer = pool.pop() if pool else np.empty(shape, dtype=np.float64)
+                    _apply(ufunc, operands, buffer)
+                    scratch.add(id(buffer))
+                    values[node] = buffer
+
+                if not early:
+                    for child in node.children:
+                        release(child)
+
+    result = values[expression]
+    if out is not None:
+        np.copyto(out, result)
+        return out
+
+    if id(result) in scratch:
+        return result
+    return np.array(np.broadcast_to(result, shape))
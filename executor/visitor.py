@@ -1,6 +1,7 @@
 from typing import Callable, Any
 
 from symbols import Node
+from symbols.node import fold
 
 Visitor = Callable[[Node, list[Any]], Any]
 
@@ -18,6 +19,5 @@ class ExpressionVisitor:
         self.visitor = visitor
 
     def visit(self, node: Node):
-        # visit the children
-        results = [self.visit(child) for child in node.children]
-        return self.visitor(node, results)
+        # visit the children first, without recursion, shared subtrees are visited once
+        return fold(node, self.visitor)
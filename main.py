@@ -1,30 +1,180 @@
-import symbols.literal as lit
-import symbols.binary as binary
-import symbols.function as fn
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import multiprocessing.util
+import sys
+from typing import Any, Iterable, Iterator, TextIO
+
+from executor.evaluator import evaluate
 from executor.simplify import simplify_expression
-from symbols import operator, function
+from executor.store import ResultStore
+from symbols import operator
 from symbols.overload import overload, as_expression
 
+MODES = ('simplify', 'evaluate')
+
+# the persistent store of the process, opened on first use
+_store: ResultStore | None = None
+
+
+class RecordError(RuntimeError):
+    pass
+
+
+def parse_record(line: str, form: str) -> tuple[str, dict[str, float]]:
+    """
+    Reads the expression and the variable values of an input line
+    """
+    if form == 'text':
+        return line.strip(), {}
+
+    record = json.loads(line)
+    if isinstance(record, str):
+        return record, {}
+    if not isinstance(record, dict) or not isinstance(record.get('expression'), str):
+        raise RecordError("a record is a string or an object with an 'expression' string")
+    return record['expression'], dict(record.get('env', {}))
+
+
+def process(line: str, options: argparse.Namespace) -> tuple[bool, Any]:
+    """
+    Runs the requested work on an input line
+    :return: Whether it succeeded, and the result or the error message, None for a blank line
+    """
+    if not line.strip():
+        return True, None
+    try:
+        text, env = parse_record(line, options.format)
+        expression = as_expression(text)
+        for variable in options.diff:
+            expression = operator.Diff(expression, variable)
+
+        if options.mode == 'evaluate':
+            return True, float(evaluate(expression, {**options.env, **env}))
+        return True, simplify_expression(expression, store=_open_store(options.store)).as_display()
+    except Exception as error:
+        return False, f"{type(error).__name__}: {error}"
+
+
+def _open_store(directory: str | None) -> ResultStore | None:
+    global _store
+    if directory is not None and _store is None:
+        _store = ResultStore(directory)
+    return _store
+
 
-def main():
+def _close_store() -> None:
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def _process(item: tuple[int, str, argparse.Namespace]) -> tuple[int, bool, Any]:
+    number, line, options = item
+    return number, *process(line, options)
+
+
+def _initialize() -> None:
     overload()
+    # the pending writes of the workers are committed as they exit
+    multiprocessing.util.Finalize(None, _close_store, exitpriority=10)
+
+
+def run(lines: Iterable[str], options: argparse.Namespace) -> Iterator[tuple[int, bool, Any]]:
+    """
+    Processes the lines in order, in blocks so the input is never read whole
+    :return: The line number, whether it succeeded, and the result or the error message of every line,
+        the result of a blank line is None
+    """
+    items = ((number, line, options) for number, line in enumerate(lines, 1))
+    if options.workers == 1:
+        _initialize()
+        try:
+            yield from map(_process, items)
+        finally:
+            _close_store()
+        return
+
+    block = options.workers * options.chunksize * 4
+    with multiprocessing.Pool(options.workers, _initialize) as pool:
+        while chunk := list(itertools.islice(items, block)):
+            yield from pool.imap(_process, chunk, options.chunksize)
+        # let the workers exit on their own rather than terminating them
+        pool.close()
+        pool.join()
+
+
+def write(results: Iterable[tuple[int, bool, Any]], options: argparse.Namespace, out: TextIO, err: TextIO) -> int:
+    """
+    Writes a result per record. Text output has a line per input line, errors go to the error stream and blank
+    lines and errors leave an empty line to keep the alignment, json lines carry the line numbers and skip blank lines
+    :return: The number of failed records
+    """
+    failures = 0
+    for number, ok, value in results:
+        failures += not ok
+        if options.format == 'jsonl':
+            if value is None:
+                continue
+            if isinstance(value, float) and not math.isfinite(value):
+                # json has no nan or infinities
+                value = str(value)
+            out.write(json.dumps({'line': number, 'result' if ok else 'error': value}) + '\n')
+        elif value is None:
+            out.write('\n')
+        elif ok:
+            out.write(f"{value}\n")
+        else:
+            out.write('\n')
+            err.write(f"line {number}: {value}\n")
+        out.flush()
+    return failures
+
+
+def binding(text: str) -> tuple[str, float]:
+    name, separator, value = text.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected name=value, got '{text}'")
+    return name.strip(), float(value)
+
+
+def arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simplifies, differentiates or evaluates a stream of expressions, "
+                                                 "one per line")
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                        help="the input file, stdin by default")
+    parser.add_argument('-f', '--format', choices=('text', 'jsonl'), default='text',
+                        help="plain expressions, or json strings or objects with 'expression' and an optional 'env'")
+    parser.add_argument('-m', '--mode', choices=MODES, default='simplify')
+    parser.add_argument('-d', '--diff', action='append', default=[], metavar='VARIABLE',
+                        help="differentiate with respect to the variable first, can be repeated")
+    parser.add_argument('-e', '--env', action='append', default=[], type=binding, metavar='NAME=VALUE',
+                        help="a variable value for evaluate, records may override it")
+    parser.add_argument('-s', '--store', metavar='DIRECTORY',
+                        help="keep the simplified expressions in a persistent store in the directory")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="the number of processes")
+    parser.add_argument('-c', '--chunksize', type=int, default=16,
+                        help="the number of records sent to a process at a time")
 
+    options = parser.parse_args(argv)
+    if options.workers < 1 or options.chunksize < 1:
+        parser.error("workers and chunksize must be positive")
+    options.env = dict(options.env)
+    return options
 
-    # x = lit.Variable('x')
-    # z = lit.Variable('z')
-    # expression = function.Cos(x * lit.Real(2.0)) * lit.Real(2) * z ** lit.Real(2.0)
-    # expression = as_expression('x ** x')
-    # dydx = operator.Diff(expression, 'x')
-    # dydz = operator.Diff(expression, 'z')
-    # print(dydx.as_display())
-    # print(simplify_expression(simplify_expression(dydx)).as_display())
-    # print('')
-    # print(dydz.as_display())
-    # print(simplify_expression(dydz).as_display())
 
-    expression = 'dx(2**x * sin(x) / cos(2*x))'
-    print(simplify_expression(as_expression(expression)).as_display())
+def main(argv: list[str] | None = None) -> int:
+    options = arguments(argv)
+    input_file = options.input
+    # the open file cannot be sent to the workers
+    del options.input
 
+    failures = write(run(input_file, options), options, sys.stdout, sys.stderr)
+    return 1 if failures else 0
 
-main()
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,54 +1,96 @@
-from symbols.node import Node, NodePrecedence
+from symbols import literal
+from symbols.node import NOT_POLYNOMIAL, Node, NodePrecedence, power_bounds, product_bounds, sum_bounds
 
 
 class Binary(Node):
+    """
+    A node of two children, kept in slots rather than a tuple
+    """
+
+    __slots__ = ('_left', '_right')
+
+    def __init__(self, left: Node, right: Node) -> None:
+        super().__init__()
+        self._left = left
+        self._right = right
+
+    @property
+    def children(self) -> tuple[Node, Node]:
+        return self._left, self._right
+
     @property
     def left(self):
-        return self.children[0]
+        return self._left
 
     @property
     def right(self):
-        return self.children[1]
+        return self._right
 
     @left.setter
     def left(self, value):
-        self.children[0] = value
+        self.set_child(0, value)
 
     @right.setter
     def right(self, value):
-        self.children[1] = value
+        self.set_child(1, value)
+
+    def _replace(self, index: int, value: Node) -> None:
+        if index == 0:
+            self._left = value
+        elif index == 1:
+            self._right = value
+        else:
+            super()._replace(index, value)
 
 
 class Add(Binary):
+    __slots__ = ()
+    symbol = '%0 + %1'
     precedence = NodePrecedence.ADD
 
-    def __init__(self, left: Node, right: Node):
-        super().__init__([left, right], '%0 + %1')
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return sum_bounds(self.children)
 
 
 class Sub(Binary):
+    __slots__ = ()
+    symbol = '%0 - %1'
     precedence = NodePrecedence.SUB
 
-    def __init__(self, left: Node, right: Node):
-        super().__init__([left, right], '%0 - %1')
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return sum_bounds(self.children)
 
 
 class Mul(Binary):
+    __slots__ = ()
+    symbol = '%0 * %1'
     precedence = NodePrecedence.MUL
 
-    def __init__(self, left: Node, right: Node):
-        super().__init__([left, right], '%0 * %1')
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return product_bounds(self.children)
 
 
 class Div(Binary):
+    __slots__ = ()
+    symbol = '%0 / %1'
     precedence = NodePrecedence.DIV
 
-    def __init__(self, left: Node, right: Node):
-        super().__init__([left, right], '%0 / %1')
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        # only divisions by numbers, which scale the coefficients
+        degree, terms, leaves = self._left._polynomial
+        if degree < 0 or not isinstance(self._right, literal.Real) or self._right.number == 0:
+            return NOT_POLYNOMIAL
+        return degree, terms, leaves + 1
 
 
 class Pow(Binary):
+    __slots__ = ()
+    symbol = '%0 ^ %1'
     precedence = NodePrecedence.POW
 
-    def __init__(self, base: Node, exp: Node):
-        super().__init__([base, exp], '%0 ^ %1')
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        # only literal exponents, so the degree is known before expanding
+        exponent = self._right
+        if not isinstance(exponent, literal.Real) or not literal.is_natural(exponent.number):
+            return NOT_POLYNOMIAL
+        return power_bounds(self._left, int(exponent.number))
@@ -0,0 +1,76 @@
+import weakref
+from typing import Any
+
+from symbols.node import Node, postorder
+
+
+class NodeFactory:
+    """
+    Hash-consing node factory, structurally identical nodes (same class, data and children)
+    made through the same factory are the same frozen object, so the trees become DAGs
+    """
+
+    # maps (class, data, children ids) to the unique node, dead nodes are dropped automatically
+    table: weakref.WeakValueDictionary
+
+    def __init__(self) -> None:
+        self.table = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def owns(self, node: Node) -> bool:
+        """
+        Returns whether the node is the interned node of this factory
+        :param node: The node
+        :return: Whether the node was made by this factory
+        """
+        if not node.frozen:
+            return False
+
+        # children are interned, so their identities stand in for their structure
+        key = node.__class__, node.data, tuple(id(child) for child in node.children)
+        return self.table.get(key) is node
+
+    def intern(self, node: Node) -> Node:
+        """
+        Returns the unique frozen node structurally identical to the given tree,
+        interning every subtree along the way
+        :param node: The tree, which is left untouched
+        :return: The interned tree
+        """
+        # maps the ids of the visited nodes to their interned nodes, owned subtrees are skipped as they map to themselves
+        interned = {}
+        for current in postorder(node, self.owns):
+            children = [interned.get(id(child), child) for child in current.children]
+            key = current.__class__, current.data, tuple(id(child) for child in children)
+
+            found = self.table.get(key)
+            if found is None:
+                found = current.with_children(children)
+                found.frozen = True
+                self.table[key] = found
+
+            interned[id(current)] = found
+
+        return interned.get(id(node), node)
+
+    def make(self, cls: type[Node], *args: Any) -> Node:
+        """
+        Constructs and interns a node, for example make(binary.Add, left, right)
+        :param cls: The node class
+        :param args: The constructor arguments
+        :return: The interned node
+        """
+        return self.intern(cls(*args))
+
+    def clear(self):
+        self.table.clear()
+
+
+# the process wide factory, for callers that do not need separate tables
+default_factory = NodeFactory()
+
+
+def intern(node: Node) -> Node:
+    return default_factory.intern(node)
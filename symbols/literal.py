@@ -1,48 +1,77 @@
+import math
+
 from symbols.node import Node, NodePrecedence
 
 
 class Literal(Node):
-    pass
+    __slots__ = ()
 
 
 class Variable(Literal):
+    __slots__ = ('symbol',)
+
     precedence = NodePrecedence.LITERAL
 
     def __init__(self, symbol: str = 'x'):
-        super().__init__([], symbol)
+        super().__init__()
+        self.symbol = symbol
 
-    def as_symbol(self):
+    def format(self, parts: list[str]) -> str:
         return self.symbol
 
-    def as_display(self, parent_precedence: NodePrecedence = NodePrecedence.LOWEST) -> str:
-        return self.symbol
+    def with_children(self, children) -> Node:
+        return Variable(self.symbol)
+
+    def _compute_variables(self) -> frozenset[str]:
+        return frozenset((self.symbol,))
+
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return 1, 1, 1
 
 
 class Real(Literal):
+    __slots__ = ('number',)
+
     number: float
+    symbol = 'R'
     precedence = NodePrecedence.LITERAL
 
     def __init__(self, number: float):
-        super().__init__([], 'R')
+        super().__init__()
         self.number = number
 
-    def as_symbol(self):
+    def format(self, parts: list[str]) -> str:
         return f"{self.number}"
 
-    def as_display(self, parent_precedence: NodePrecedence = NodePrecedence.LOWEST) -> str:
-        return f"{self.number}"
+    @property
+    def data(self):
+        # the number type and the sign are kept, as Real(2) and Real(2.0), or 0.0 and -0.0, display differently
+        return type(self.number), self.number, math.copysign(1.0, self.number)
+
+    def _compute_structure(self) -> tuple:
+        # the data with the name of the number type, as types do not order
+        return self.__class__.__name__, self.number, math.copysign(1.0, self.number), type(self.number).__name__
+
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return 0, 1, 1
 
-    def copy(self) -> 'Node':
-        return Real(self.number)
+    def with_children(self, children) -> Node:
+        return self.__class__(self.number)
 
 
 class Int(Real):
+    __slots__ = ()
+
     number: int
+    symbol = 'I'
     precedence = NodePrecedence.LITERAL
 
-    def __init__(self, number: int):
-        super().__init__(number)
-        self.symbol = 'I'
+
+def is_natural(number: float) -> bool:
+    """
+    Whether the number is a nonnegative integer, of either type
+    """
+    return number >= 0 and (isinstance(number, int) or float(number).is_integer())
 
 
 Literal = Variable | Real
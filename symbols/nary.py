@@ -0,0 +1,189 @@
+import functools
+import operator as op
+from typing import Callable, Iterable
+
+from symbols import binary, literal
+from symbols.node import Node, NodePrecedence, Expression, fold, product_bounds, sum_bounds
+
+
+class NAry(Node):
+    """
+    A node of any number of operands of an associative and commutative operation. Nested nodes of the same class
+    are flattened, the constant operands are folded into one and the operands are kept in canonical order,
+    the constant first, then the variables by name, then the compound terms by their structure
+    """
+
+    __slots__ = ('_children',)
+
+    operator: str  # the python operator between the operands
+    combine: Callable[[float, float], float]  # the operation on two numbers
+    identity: int  # the operand that leaves the others unchanged, dropped when folding
+    chain: type[binary.Binary]  # the binary node of the operation
+
+    _pieces: dict[int, tuple[str | int, ...]]  # the display pieces by number of operands
+
+    def __init__(self, *operands: Node) -> None:
+        super().__init__()
+
+        terms: list[Node] = []
+        numbers: list[int | float] = []
+        integral = True
+        for operand in operands:
+            for term in operand.children if operand.__class__ is self.__class__ else (operand,):
+                if isinstance(term, literal.Real):
+                    numbers.append(term.number)
+                    integral = integral and isinstance(term, literal.Int)
+                else:
+                    terms.append(term)
+
+        terms.sort(key=_order)
+        if numbers:
+            number = functools.reduce(self.combine, numbers)
+            if number != self.identity or not terms:
+                terms.insert(0, literal.Int(number) if integral else literal.Real(number))
+        elif not terms:
+            terms.append(literal.Int(self.identity))
+
+        self._children = tuple(terms)
+
+    @property
+    def children(self) -> tuple[Node, ...]:
+        return self._children
+
+    def _replace(self, index: int, value: Node) -> None:
+        if not 0 <= index < len(self._children):
+            super()._replace(index, value)
+        self._children = self._children[:index] + (value,) + self._children[index + 1:]
+
+    def pieces(self) -> tuple[str | int, ...]:
+        count = len(self._children)
+        pieces = self._pieces.get(count)
+        if pieces is None:
+            separator = f' {self.operator} '
+            pieces = self._pieces[count] = ('', *(
+                piece for index in range(count) for piece in ((separator, index) if index else (index,))
+            ), '')
+        return pieces
+
+
+def _order(term: Node) -> tuple:
+    # variables before the compound terms, the constants are taken out before sorting. The compound terms are ordered
+    # by their structure, which is the same in every process
+    if isinstance(term, literal.Variable):
+        return 0, term.symbol
+    return 1, term.structure
+
+
+class Sum(NAry):
+    __slots__ = ()
+    symbol = '%0 + ...'
+    operator = '+'
+    combine = staticmethod(op.add)
+    identity = 0
+    chain = binary.Add
+    precedence = NodePrecedence.ADD
+    _pieces = {}
+
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return sum_bounds(self._children)
+
+
+class Product(NAry):
+    __slots__ = ()
+    symbol = '%0 * ...'
+    operator = '*'
+    combine = staticmethod(op.mul)
+    identity = 1
+    chain = binary.Mul
+    precedence = NodePrecedence.MUL
+    _pieces = {}
+
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return product_bounds(self._children)
+
+
+# the n-ary node of each binary chain
+_chains: dict[type[Node], type[NAry]] = {
+    binary.Add: Sum,
+    binary.Mul: Product,
+}
+
+
+def _build(cls: type[NAry], operands: Iterable[Node]) -> Node:
+    # a single operand left after folding stands for itself
+    node = cls(*operands)
+    return node.children[0] if len(node.children) == 1 else node
+
+
+class _Chain:
+    """
+    The operands of a chain below its root, flattened and sorted once the root is reached
+    """
+
+    __slots__ = ('cls', 'parts')
+
+    def __init__(self, cls: type[NAry], parts: list['Expression | _Chain']) -> None:
+        self.cls = cls
+        self.parts = parts  # the operands and the chains of the same class below
+
+
+def _complete(result: 'Expression | _Chain') -> Expression:
+    # builds the n-ary node of a chain at its root, the chains below are walked without recursion
+    if not isinstance(result, _Chain):
+        return result
+
+    operands = []
+    stack = [result]
+    while stack:
+        part = stack.pop()
+        if isinstance(part, _Chain):
+            stack.extend(reversed(part.parts))
+        else:
+            operands.append(part)
+    return _build(result.cls, operands)
+
+
+def canonicalize(expression: Expression) -> Expression:
+    """
+    Replaces the sum and product chains by n-ary nodes in a single bottom up pass, sorting and folding their operands.
+    Each chain is built once at its root, so the pass takes O(n log n). Differences, quotients and the other nodes
+    are kept, with their operands canonicalized
+    :param expression: The expression, which is not modified
+    :return: The canonical expression, sharing the untouched subtrees with the given one
+    """
+    def visit(node: Node, results: list[Expression | _Chain]) -> Expression | _Chain:
+        cls = _chains.get(node.__class__)
+        if cls is None and isinstance(node, NAry):
+            cls = node.__class__
+        if cls is not None:
+            # the chains of other classes end here
+            return _Chain(cls, [
+                result if isinstance(result, _Chain) and result.cls is cls else _complete(result) for result in results
+            ])
+
+        results = [_complete(result) for result in results]
+        if all(result is child for result, child in zip(results, node.children)):
+            return node
+        return node.with_children(results)
+
+    return _complete(fold(expression, visit))
+
+
+def to_binary(expression: Expression) -> Expression:
+    """
+    Replaces the n-ary nodes by left aligned chains of binary nodes, for the rules and backends working on those
+    :param expression: The expression, which is not modified
+    :return: The binary expression, sharing the untouched subtrees with the given one
+    """
+    def visit(node: Node, results: list[Expression]) -> Expression:
+        if isinstance(node, NAry):
+            chain = results[0]
+            for operand in results[1:]:
+                chain = node.chain(chain, operand)
+            return chain
+
+        if all(result is child for result, child in zip(results, node.children)):
+            return node
+        return node.with_children(results)
+
+    return fold(expression, visit)
@@ -1,4 +1,7 @@
+import math
+import weakref
 from enum import IntEnum
+from typing import Any, Callable, Iterable, Iterator, TextIO
 
 
 class NodePrecedence(IntEnum):
@@ -15,58 +18,505 @@ class NodePrecedence(IntEnum):
     HIGHEST = 100
 
 
+class ImmutableNodeError(RuntimeError):
+    pass
+
+
+# the number of children replaced so far. The cached values of nodes that are not frozen are only used while it is
+# unchanged, as the replaced child may be a descendant whose ancestors do not know about it
+_mutations = 0
+
+# the polynomial bounds of the expressions that are not polynomials
+NOT_POLYNOMIAL = (-1, 0, 0)
+
+
 class Node:
-    children: list['Node']  # the child nodes
-    symbol: str  # a format-able string of printable items
+    """
+    The base of the expression nodes. The display template and the precedence are per class,
+    instances only hold their children and the cached structural values
+    """
+
+    __slots__ = ('frozen', '_hash', '_normal_under', '_variables', '_has_diff', '_structure', '_polynomial', '_epoch',
+                 '__weakref__')
+
+    children: tuple['Node', ...] = ()  # the child nodes, leaves have none
+    symbol: str = ''  # a format-able string of printable items, %0 and %1 are the children
     precedence: NodePrecedence = NodePrecedence.LOWEST  # the higher, the more grouped it is
+    frozen: bool  # frozen nodes cannot have their children replaced
+    _hash: int | None  # the cached structural hash
+    _normal_under: object | None  # the rule set key under which the node is known to be simplified
+    _variables: frozenset[str] | None  # the cached free variables
+    _has_diff: bool | None  # the cached diff containment
+    _structure: tuple | None  # the cached structure key
+    _polynomial: tuple[int, int, int] | None  # the cached polynomial bounds
+    _epoch: int  # the number of replaced children when the cached values were last checked
 
-    def __init__(self, children: list['Node'], symbol: str) -> None:
-        self.children = children
-        self.symbol = symbol
+    def __init__(self) -> None:
+        self.frozen = False
+        self._hash = None
+        self._normal_under = None
+        self._variables = None
+        self._has_diff = None
+        self._structure = None
+        self._polynomial = None
+        self._epoch = _mutations
 
-    def as_symbol(self) -> str:
-        replaced = self.symbol
+    @property
+    def data(self) -> Any:
+        """
+        The non-child data that distinguishes this node from others of the same class
+        """
+        return self.symbol
 
-        # start the replacing step
-        for index, value in enumerate(self.children):
-            replaced = replaced.replace(
-                f'%{index}',
-                f"( {value.as_symbol()} )"
+    def set_child(self, index: int, value: 'Node'):
+        if self.frozen:
+            raise ImmutableNodeError(
+                f"unable to replace the child of a frozen node, type(node) = {type(self)}"
             )
 
-        return replaced
+        global _mutations
+        self._replace(index, value)
+        _mutations += 1
+        self.invalidate()
+
+    def _replace(self, index: int, value: 'Node') -> None:
+        raise IndexError(f"child index {index} out of range, type(node) = {type(self)}")
+
+    def invalidate(self):
+        """
+        Clears the cached hash, metadata and normal form marker of this node. Those of its ancestors are dropped
+        when next used, as any replaced child outdates the cached values of the nodes that are not frozen
+        """
+        self._hash = None
+        self._variables = None
+        self._has_diff = None
+        self._structure = None
+        self._polynomial = None
+        self._normal_under = None
+
+    def _revalidate(self) -> 'Node':
+        # frozen trees never change, the others drop their cached values after any child is replaced
+        if self._epoch != _mutations and not self.frozen:
+            self._hash = None
+            self._variables = None
+            self._has_diff = None
+            self._structure = None
+            self._polynomial = None
+            self._normal_under = None
+            self._epoch = _mutations
+        return self
+
+    @property
+    def normal_under(self) -> object | None:
+        """
+        The rule set key under which the node is known to be simplified, forgotten once any child is replaced
+        unless the node is frozen, as the replaced child may be a descendant
+        """
+        return self._revalidate()._normal_under
+
+    @normal_under.setter
+    def normal_under(self, key: object | None) -> None:
+        self._revalidate()._normal_under = key
+
+    # metadata, computed from the children once and cached
+    @property
+    def free_variables(self) -> frozenset[str]:
+        """
+        The names of the variables in the expression
+        """
+        if self._revalidate()._variables is None:
+            for node in uncached(self, lambda n: n._revalidate()._variables is not None):
+                node._variables = node._compute_variables()
+        return self._variables
+
+    def _compute_variables(self) -> frozenset[str]:
+        variables = frozenset()
+        for child in self.children:
+            # reuse the child sets where possible, chains mostly share the same variables
+            other = child._variables
+            if not variables or variables < other:
+                variables = other
+            elif not other <= variables:
+                variables = variables | other
+        return variables
+
+    @property
+    def has_diff(self) -> bool:
+        """
+        Whether the expression contains an unexpanded derivative
+        """
+        if self._revalidate()._has_diff is None:
+            for node in uncached(self, lambda n: n._revalidate()._has_diff is not None):
+                node._has_diff = node._compute_has_diff()
+        return self._has_diff
+
+    def _compute_has_diff(self) -> bool:
+        return any(child._has_diff for child in self.children)
+
+    @property
+    def structure(self) -> tuple:
+        """
+        The class name, data and the structures of the children as nested tuples, which order the trees the same way
+        in every process. Shared subtrees share their tuples, so comparing them stops early
+        """
+        if self._revalidate()._structure is None:
+            for node in uncached(self, lambda n: n._revalidate()._structure is not None):
+                node._structure = node._compute_structure()
+        return self._structure
+
+    def _compute_structure(self) -> tuple:
+        return self.__class__.__name__, self.data, *(child._structure for child in self.children)
+
+    @property
+    def polynomial_bounds(self) -> tuple[int, int, int]:
+        """
+        The total degree, a bound of the number of terms once expanded and the number of leaves, if the expression
+        is a polynomial of literal nonnegative integer powers and divisions by nonzero literals. The degree is -1
+        for other expressions
+        """
+        if self._revalidate()._polynomial is None:
+            for node in uncached(self, lambda n: n._revalidate()._polynomial is not None):
+                node._polynomial = node._compute_polynomial()
+        return self._polynomial
+
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return NOT_POLYNOMIAL
+
+    @property
+    def is_constant(self) -> bool:
+        """
+        Whether the expression has no variables or derivatives, so can be folded into a number
+        """
+        return not self.has_diff and not self.free_variables
+
+    def with_children(self, children: Iterable['Node']) -> 'Node':
+        """
+        Returns a new node of the same kind and data, with the children replaced
+        :param children: The new children
+        :return: The new node
+        """
+        return self.__class__(*children)
+
+    def format(self, parts: list[str]) -> str:
+        """
+        Fills the symbol template with the already printed children
+        :param parts: The printed children, in order
+        :return: The printed node
+        """
+        return ''.join(parts[piece] if isinstance(piece, int) else piece for piece in self.pieces())
+
+    def pieces(self) -> tuple[str | int, ...]:
+        """
+        The printed node as text and the indices of the children to print in between, for the printers.
+        Leaves print through format
+        """
+        if not self.children:
+            return self.format([]),
+        return template_pieces(self.symbol)
+
+    def as_symbol(self) -> str:
+        return ''.join(_fragments(self, _symbol_wrap, memoize=False))
 
     def copy(self) -> 'Node':
-        return Node(
-            [child.copy() for child in self.children],
-            self.symbol
-        )
+        return fold(self, lambda node, children: node.with_children(children))
 
     def as_display(self, parent_precedence: NodePrecedence = NodePrecedence.LOWEST) -> str:
-        replaced = self.symbol
-
-        # start the replacing step
-        for index, child in enumerate(self.children):
-            child_symbol = child.as_display(self.precedence)
-            replaced = replaced.replace(
-                f'%{index}',
-                child_symbol
-            )
+        """
+        Prints the expression in a single pass, the display of frozen trees is memoized
+        :param parent_precedence: The precedence of the enclosing expression, to put the parentheses around
+        :return: The printed expression
+        """
+        displayed = _memoized(self) if self.frozen else None
+        if displayed is None:
+            displayed = ''.join(_fragments(self, _display_wrap, memoize=True))
+            if self.frozen:
+                _memoize(self, displayed)
 
         if self.precedence < parent_precedence:
-            replaced = f"({replaced})"
+            displayed = f"({displayed})"
+        return displayed
 
-        return replaced
+    def write_display(self, stream: TextIO, buffer: int = 1 << 12) -> None:
+        """
+        Prints the expression into a text stream, without building the whole text in memory
+        :param stream: The stream
+        :param buffer: The number of fragments written at a time
+        """
+        chunk = []
+        for fragment in _fragments(self, _display_wrap, memoize=True):
+            chunk.append(fragment)
+            if len(chunk) >= buffer:
+                stream.write(''.join(chunk))
+                chunk.clear()
+        stream.write(''.join(chunk))
 
     # equals
+    def __hash__(self) -> int:
+        """
+        The structural hash, cached on the node. The hashes of the nodes that are not frozen are computed again
+        after any child is replaced, so modified trees keep hashing by their structure
+        """
+        if self._revalidate()._hash is None:
+            for node in uncached(self, lambda n: n._revalidate()._hash is not None):
+                node._hash = hash((node.__class__, node.data, *(child._hash for child in node.children)))
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Structural equality, the same class, data and children, most unequal trees are rejected on the hash
+        """
+        pairs = [(self, other)]
+        while pairs:
+            left, right = pairs.pop()
+            if left is right:
+                continue
+
+            if not isinstance(right, Node) \
+                    or left.__class__ is not right.__class__ \
+                    or hash(left) != hash(right) \
+                    or left.data != right.data \
+                    or len(left.children) != len(right.children):
+                return False
+
+            pairs.extend(zip(left.children, right.children))
+
+        return True
+
     def weak_equals(self, other: 'Node') -> bool:
         """
         Weak equals compares the display out of the expressions to be the same,
-        does not regard the AST structure
+        does not regard the AST structure, prefer == for structural equality
         :param other: The other expression
         :return: Whether they are equal
         """
         return self.as_display() == other.as_display()
 
 
+class UnaryNode(Node):
+    """
+    A node of a single child, kept in a slot rather than a tuple
+    """
+
+    __slots__ = ('_child',)
+
+    def __init__(self, expression: Node) -> None:
+        super().__init__()
+        self._child = expression
+
+    @property
+    def children(self) -> tuple[Node]:
+        return self._child,
+
+    @property
+    def expression(self) -> Node:
+        return self._child
+
+    @expression.setter
+    def expression(self, value: Node):
+        self.set_child(0, value)
+
+    def _replace(self, index: int, value: Node) -> None:
+        if index != 0:
+            super()._replace(index, value)
+        self._child = value
+
+
 Expression = Node
+
+# the display of frozen nodes by id, frozen trees cannot change. Keyed by identity rather than equality,
+# as equal trees may print differently, 0.0 and -0.0. Entries are dropped along with their node
+display_cache: dict[int, tuple[weakref.ref, str]] = {}
+
+
+def _memoized(node: Node) -> str | None:
+    entry = display_cache.get(id(node))
+    if entry is not None and entry[0]() is node:
+        return entry[1]
+    return None
+
+
+def _memoize(node: Node, displayed: str) -> None:
+    key = id(node)
+    display_cache[key] = (weakref.ref(node, lambda _: display_cache.pop(key, None)), displayed)
+
+
+_template_pieces: dict[str, tuple[str | int, ...]] = {}
+
+
+def template_pieces(template: str) -> tuple[str | int, ...]:
+    """
+    Splits a symbol template into text and child indices, '%0 + %1' gives ('', 0, ' + ', 1, '')
+    """
+    pieces = _template_pieces.get(template)
+    if pieces is None:
+        pieces = []
+        for index, text in enumerate(template.split('%')):
+            if index and text[:1].isdigit():
+                digits = len(text) - len(text.lstrip('0123456789'))
+                pieces += int(text[:digits]), text[digits:]
+            else:
+                pieces.append(text if not index else '%' + text)
+        # merge the neighbouring text
+        merged: list[str | int] = []
+        for piece in pieces:
+            if merged and isinstance(piece, str) and isinstance(merged[-1], str):
+                merged[-1] += piece
+            else:
+                merged.append(piece)
+        pieces = _template_pieces[template] = tuple(merged)
+    return pieces
+
+
+def _display_wrap(node: Node, child: Node) -> tuple[str, str] | None:
+    return ('(', ')') if child.precedence < node.precedence else None
+
+
+def _symbol_wrap(node: Node, child: Node) -> tuple[str, str] | None:
+    return '( ', ' )'
+
+
+def _fragments(root: Node, wrap: Callable[[Node, Node], tuple[str, str] | None], memoize: bool) -> Iterator[str]:
+    """
+    Yields the printed expression piece by piece with an explicit stack, so the output is built in linear time
+    :param root: The root node
+    :param wrap: Returns the parentheses to put around a child, if any
+    :param memoize: Whether to reuse the memoized display of frozen subtrees
+    :return: The printed fragments, in order
+    """
+    stack: list[Node | str] = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+
+        if memoize and item.frozen:
+            displayed = _memoized(item)
+            if displayed is not None:
+                yield displayed
+                continue
+
+        children = item.children
+        for piece in reversed(item.pieces()):
+            if isinstance(piece, str):
+                if piece:
+                    stack.append(piece)
+                continue
+
+            child = children[piece]
+            parentheses = wrap(item, child)
+            if parentheses is None:
+                stack.append(child)
+            else:
+                stack += parentheses[1], child, parentheses[0]
+
+
+def postorder(root: Node, prune: Callable[[Node], bool] | None = None,
+              leaf: Callable[[Node], bool] | None = None) -> Iterator[Node]:
+    """
+    Iterates the tree children first with an explicit stack, so any depth can be traversed.
+    Subtrees shared between parents are only visited once
+    :param root: The root node
+    :param prune: Returns whether to skip a node and its subtree
+    :param leaf: Returns whether to visit a node without its subtree
+    :return: The nodes, each after all of its children
+    """
+    visited = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+
+        if id(node) in visited or (prune is not None and prune(node)):
+            continue
+        visited.add(id(node))
+
+        stack.append((node, True))
+        if leaf is None or not leaf(node):
+            stack.extend((child, False) for child in reversed(node.children))
+
+
+def sum_bounds(children: Iterable[Node]) -> tuple[int, int, int]:
+    """
+    The polynomial bounds of a sum of the children, from their cached bounds
+    """
+    degree, terms, leaves = 0, 0, 0
+    for child in children:
+        child_degree, child_terms, child_leaves = child._polynomial
+        if child_degree < 0:
+            return NOT_POLYNOMIAL
+        degree, terms, leaves = max(degree, child_degree), terms + child_terms, leaves + child_leaves
+    return degree, terms, leaves
+
+
+def product_bounds(children: Iterable[Node]) -> tuple[int, int, int]:
+    """
+    The polynomial bounds of a product of the children, from their cached bounds
+    """
+    degree, terms, leaves = 0, 1, 0
+    for child in children:
+        child_degree, child_terms, child_leaves = child._polynomial
+        if child_degree < 0:
+            return NOT_POLYNOMIAL
+        degree, terms, leaves = degree + child_degree, terms * child_terms, leaves + child_leaves
+    return degree, terms, leaves
+
+
+def power_bounds(base: Node, exponent: int) -> tuple[int, int, int]:
+    """
+    The polynomial bounds of the base raised to a nonnegative integer literal, the monomials of the power are
+    the multisets of as many monomials of the base
+    """
+    degree, terms, leaves = base._polynomial
+    if degree < 0:
+        return NOT_POLYNOMIAL
+    return degree * exponent, math.comb(terms + exponent - 1, exponent), leaves + 1
+
+
+def uncached(root: Node, cached: Callable[[Node], bool]) -> Iterable[Node]:
+    """
+    Returns the nodes of the tree missing a cached value, children first, skipping the cached subtrees
+    :param root: The root node, which is not cached
+    :param cached: Returns whether a node has the value cached
+    :return: The nodes to compute the value for, in order
+    """
+    # new nodes built over cached children or new leaves are the common case, and need no traversal
+    pending = [child for child in root.children if not cached(child)]
+    if all(not child.children for child in pending):
+        pending.append(root)
+        return pending
+    return postorder(root, cached)
+
+
+def fold(root: Node, fn: Callable[[Node, list[Any]], Any], leaf: Callable[[Node], bool] | None = None) -> Any:
+    """
+    Computes fn(node, results of the children) bottom up without recursion,
+    shared subtrees are computed once and results are dropped once all their parents are computed
+    :param root: The root node
+    :param fn: The function of a node and the results of its children
+    :param leaf: Returns whether to call fn on a node with no results instead of visiting its subtree
+    :return: The result of the root
+    """
+    order = list(postorder(root, leaf=leaf))
+    inner = [() if leaf is not None and leaf(node) else node.children for node in order]
+
+    # count the parents of every node first, so results can be dropped once all of them are computed
+    uses = {}
+    for children in inner:
+        for child in children:
+            uses[id(child)] = uses.get(id(child), 0) + 1
+
+    results = {}
+    for node, children in zip(order, inner):
+        parts = []
+        for child in children:
+            key = id(child)
+            parts.append(results[key])
+            uses[key] -= 1
+            if not uses[key]:
+                del results[key]
+        results[id(node)] = fn(node, parts)
+
+    return results[id(root)]
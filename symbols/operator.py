@@ -1,19 +1,23 @@
 from symbols import Node
-from symbols.node import NodePrecedence
+from symbols.node import NodePrecedence, UnaryNode
 
 
-class Diff(Node):
+class Diff(UnaryNode):
+    __slots__ = ('regard',)
+
     regard: str
     precedence = NodePrecedence.FUNCTION
 
     def __init__(self, expression: Node, symbol: str = 'x'):
-        super().__init__([expression], f'd/d{symbol} %0')
+        super().__init__(expression)
         self.regard = symbol
 
     @property
-    def expression(self):
-        return self.children[0]
+    def symbol(self) -> str:
+        return f'd/d{self.regard} %0'
+
+    def with_children(self, children) -> Node:
+        return Diff(*children, self.regard)
 
-    @expression.setter
-    def expression(self, value):
-        self.children[0] = value
\ No newline at end of file
+    def _compute_has_diff(self) -> bool:
+        return True
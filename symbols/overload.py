@@ -4,6 +4,8 @@ from symbols import binary, literal, function, operator, unary
 from symbols.node import Node, Expression
 from symbols.binary import Add, Sub, Mul, Div, Pow
 from symbols.unary import Negate
+from symbols.parser import parse_cache, parse_cached
+from symbols.cache import LRUCache
 
 
 class OverloadException(RuntimeError):
@@ -69,10 +71,34 @@ class AstTransformerError(RuntimeError):
 
 class AstTransformer:
     """
-    Recursive tree transformer, a class as configuration might be needed
+    Tree transformer, a class as configuration might be needed. The python ast is walked with an explicit stack,
+    so deeply nested expressions do not hit the recursion limit
     """
 
     def transform(self, pyast: Any) -> Node:
+        # post-order walk, each python node is built once all of its operands are transformed
+        results = []
+        stack = [(pyast, None)]
+        while stack:
+            current, count = stack.pop()
+            if count is not None:
+                operands = results[len(results) - count:]
+                del results[len(results) - count:]
+                results.append(self.build(current, operands))
+                continue
+
+            operands = self.operands(current)
+            stack.append((current, len(operands)))
+            stack.extend((operand, None) for operand in reversed(operands))
+
+        return results[0]
+
+    def operands(self, pyast: Any) -> list[Any]:
+        """
+        Returns the python nodes to transform before the given node, validating its shape
+        :param pyast: The python node
+        :return: The operands of the python node
+        """
         match pyast:
             case ast.Module():
                 # only parses the first body expression value
@@ -86,12 +112,40 @@ class AstTransformer:
                         f"unable to parse a module with a non-expression body"
                     )
 
-                return self.transform(expression.value)
+                return [expression.value]
 
             case ast.BinOp():
-                # parse as binary operator, first parse left and right
-                left = self.transform(pyast.left)
-                right = self.transform(pyast.right)
+                return [pyast.left, pyast.right]
+
+            case ast.UnaryOp():
+                return [pyast.operand]
+
+            case ast.Call():
+                # reject with multiple args
+                if len(pyast.args) != 1:
+                    raise AstTransformerError(
+                        f"function cannot have multiple arguments, len(args) = {len(pyast.args)}"
+                    )
+
+                return [pyast.args[0]]
+
+            case _:
+                return []
+
+    def build(self, pyast: Any, operands: list[Node]) -> Node:
+        """
+        Builds the node of a python node from its transformed operands
+        :param pyast: The python node
+        :param operands: The transformed operands
+        :return: The node
+        """
+        match pyast:
+            case ast.Module():
+                return operands[0]
+
+            case ast.BinOp():
+                # parse as binary operator
+                left, right = operands
 
                 match pyast.op:
                     case ast.Add():
@@ -127,19 +181,11 @@ class AstTransformer:
                     )
 
             case ast.UnaryOp():
-                value = self.transform(pyast.operand)
-                return unary.Negate(value)
+                return unary.Negate(operands[0])
 
             case ast.Call():
                 # parse functions
-
-                # reject with multiple args
-                if len(pyast.args) != 1:
-                    raise AstTransformerError(
-                        f"function cannot have multiple arguments, len(args) = {len(pyast.args)}"
-                    )
-
-                expression = self.transform(pyast.args[0])
+                expression = operands[0]
 
                 # identify name
                 name = str(pyast.func.id)
@@ -163,15 +209,24 @@ class AstTransformer:
                             f"unknown function name: '{name}'"
                         )
 
-
             case _:
                 raise AstTransformerError(
                     f"unknown node type, type(node) = {type(pyast)}"
                 )
 
 
+def as_expression(expression: str, cache: LRUCache | None = parse_cache) -> Expression:
+    """
+    Parses the expression with the dedicated parser, the tree is the same as the one of the python ast transformer
+    :param expression: The text
+    :param cache: The cache of parsed trees, the trees of cached texts are shared so they are frozen,
+        None to always parse into a new tree
+    :return: The expression tree
+    """
+    return parse_cached(expression, cache)
+
 
-def as_expression(expression: str) -> Expression:
+def as_expression_ast(expression: str) -> Expression:
     parsed = ast.parse(expression, 'as_expression__inner')
     transformer = AstTransformer()
     return transformer.transform(parsed)
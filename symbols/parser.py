@@ -0,0 +1,188 @@
+import keyword
+import re
+
+from symbols.cache import LRUCache
+from symbols import binary, literal, function, operator, unary
+from symbols.node import Node, Expression, postorder
+
+
+class ParseError(RuntimeError):
+    pass
+
+
+# the parsed trees of the recent texts, shared between the callers so they are frozen
+parse_cache = LRUCache(1 << 14)
+
+# every token matches one group, characters outside the grammar match the last
+_token = re.compile(r'''
+    \s*(?:
+        (?P<number>(?:\d(?:_?\d)*\.(?:\d(?:_?\d)*)?|\.\d(?:_?\d)*|\d(?:_?\d)*)(?:[eE][+-]?\d(?:_?\d)*)?)
+      | (?P<name>[^\W\d]\w*)
+      | (?P<symbol>\*\*|[-+*/(),])
+      | (?P<other>\S)
+    )
+''', re.VERBOSE)
+
+# appended after the last token
+_end = ('', '', '', '')
+
+# the binding powers (left, right) of the infix operators, the right one is lower for the right associative power
+_infix = {
+    '+': (10, 11, binary.Add),
+    '-': (10, 11, binary.Sub),
+    '*': (20, 21, binary.Mul),
+    '/': (20, 21, binary.Div),
+    '**': (40, 39, binary.Pow),
+}
+
+# unary minus binds looser than a power on its right, -a ** b is -(a ** b)
+_prefix_power = 30
+
+_functions = {
+    'sin': function.Sin,
+    'cos': function.Cos,
+    'exp': function.Exp,
+    'log': function.Log,
+}
+
+
+def tokenize(text: str) -> list[tuple[str, str, str, str]]:
+    """
+    Splits the text into (number, name, symbol, other) tokens, of which one part is set
+    """
+    return _token.findall(text)
+
+
+def _column(text: str, index: int) -> str:
+    # columns are only needed for the errors, so they are found again
+    for position, match in enumerate(_token.finditer(text)):
+        if position == index:
+            return f"column {match.start(match.lastgroup)}"
+    return "the end"
+
+
+def _number(text: str) -> Node:
+    if any(c in text for c in '.eE'):
+        return literal.Real(float(text))
+    return literal.Int(int(text))
+
+
+def _call(name: str, text: str, index: int) -> type[Node] | str:
+    # derivatives are dX(...) with X the variable name
+    if name.startswith('d') and len(name) == 2:
+        return name[1]
+
+    cls = _functions.get(name.lower())
+    if cls is None:
+        raise ParseError(f"unknown function name: '{name}' at {_column(text, index)}")
+    return cls
+
+
+# the power of open parentheses on the pending stack, below any operator so reductions stop at them
+_group_power = -2
+
+
+def parse(text: str) -> Expression:
+    """
+    Parses an expression of + - * / **, unary minus, parentheses, numbers, variables,
+    sin/cos/exp/log and dX(...) derivatives. A Pratt parser with explicit stacks, so any length and nesting depth
+    is parsed without recursion
+    :param text: The text
+    :return: The expression tree, identical to the one of the python ast transformer
+    """
+    operands: list[Node] = []
+    # operators (power, node class, arity) waiting for their right operand,
+    # and open parentheses (group power, function or derivative variable or None, token index)
+    pending: list[tuple[int, type[Node] | str | None, int]] = []
+
+    def reduce(power: int = -1) -> None:
+        # builds the pending operators which bind their right operand at least as tight as the given power
+        while pending and pending[-1][0] >= power:
+            _, build, arity = pending.pop()
+            if arity == 2:
+                right = operands.pop()
+                operands[-1] = build(operands[-1], right)
+            else:
+                operands[-1] = build(operands[-1])
+
+    tokens = tokenize(text)
+    tokens.append(_end)
+    index = 0
+    expect_operand = True
+    while True:
+        number, name, symbol, other = tokens[index]
+        index += 1
+
+        if expect_operand:
+            if number:
+                operands.append(_number(number))
+                expect_operand = False
+            elif name:
+                if keyword.iskeyword(name):
+                    raise ParseError(f"unexpected keyword '{name}' at {_column(text, index - 1)}")
+
+                # a name followed by a parenthesis is a call
+                if tokens[index][2] == '(':
+                    pending.append((_group_power, _call(name, text, index - 1), index - 1))
+                    index += 1
+                else:
+                    operands.append(literal.Variable(name))
+                    expect_operand = False
+            elif symbol == '-':
+                pending.append((_prefix_power, unary.Negate, 1))
+            elif symbol == '(':
+                pending.append((_group_power, None, index - 1))
+            elif symbol != '+':
+                raise ParseError(f"expected an operand at {_column(text, index - 1)}")
+            continue
+
+        # an operand was just read, an operator, a closing parenthesis or the end follows
+        if symbol in _infix:
+            left, right, build = _infix[symbol]
+            reduce(left)
+            pending.append((right, build, 2))
+            expect_operand = True
+
+        elif symbol == ')':
+            reduce()
+            if not pending:
+                raise ParseError(f"unmatched ')' at {_column(text, index - 1)}")
+
+            _, function, _ = pending.pop()
+            if isinstance(function, str):
+                operands[-1] = operator.Diff(operands[-1], function)
+            elif function is not None:
+                operands[-1] = function(operands[-1])
+
+        elif not (number or name or symbol or other):
+            break
+
+        elif symbol == ',' and pending and pending[-1][0] == _group_power and pending[-1][1] is not None:
+            raise ParseError(f"function cannot have multiple arguments, at {_column(text, index - 1)}")
+
+        else:
+            raise ParseError(f"expected an operator at {_column(text, index - 1)}")
+
+    reduce()
+    if pending:
+        raise ParseError(f"unmatched '(' at {_column(text, pending[-1][2])}")
+    return operands[0]
+
+
+def parse_cached(text: str, cache: LRUCache | None = parse_cache) -> Expression:
+    """
+    Parses the text, returning the cached tree of a text parsed before
+    :param text: The text
+    :param cache: The cache of parsed trees, None to parse into a new tree which is not frozen
+    :return: The expression tree, frozen when cached
+    """
+    if cache is None:
+        return parse(text)
+
+    tree = cache.get(text)
+    if tree is None:
+        tree = parse(text)
+        for node in postorder(tree):
+            node.frozen = True
+        cache.put(text, tree)
+    return tree
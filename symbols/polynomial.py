@@ -0,0 +1,360 @@
+import math
+import operator
+from fractions import Fraction
+from typing import Any, Mapping
+
+from symbols import binary, literal, nary, unary
+from symbols.node import Node, Expression, fold, postorder
+
+Number = int | float | Fraction
+Monomial = tuple[int, ...]  # the exponents of the variables
+
+
+class PolynomialError(RuntimeError):
+    pass
+
+
+class Polynomial:
+    """
+    A sparse multivariate polynomial, the coefficients of the monomials by their exponents. The exponents are
+    tuples over the sorted variable names, and monomials of zero coefficients are not kept. Integer coefficients
+    divided by integers stay exact, as fractions
+    """
+
+    __slots__ = ('variables', 'terms')
+
+    variables: tuple[str, ...]  # the sorted variable names
+    terms: dict[Monomial, Number]  # the nonzero coefficients by the exponents of the monomials
+
+    def __init__(self, variables: tuple[str, ...] = (), terms: Mapping[Monomial, Number] | None = None) -> None:
+        self.variables = tuple(variables)
+        self.terms = {} if terms is None else {monomial: c for monomial, c in terms.items() if c != 0}
+
+    @classmethod
+    def constant(cls, number: Number) -> 'Polynomial':
+        return cls((), {(): number})
+
+    @classmethod
+    def variable(cls, name: str) -> 'Polynomial':
+        return cls((name,), {(1,): 1})
+
+    def __repr__(self) -> str:
+        return f"Polynomial({self.variables!r}, {self.terms!r})"
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Polynomial):
+            return NotImplemented
+        variables = _union(self.variables, other.variables)
+        return self._extend(variables) == other._extend(variables)
+
+    def _extend(self, variables: tuple[str, ...]) -> dict[Monomial, Number]:
+        # the terms over a superset of the variables
+        if variables == self.variables:
+            return self.terms
+        positions = [variables.index(name) for name in self.variables]
+        terms = {}
+        for monomial, coefficient in self.terms.items():
+            exponents = [0] * len(variables)
+            for position, exponent in zip(positions, monomial):
+                exponents[position] = exponent
+            terms[tuple(exponents)] = coefficient
+        return terms
+
+    def _coerce(self, other: Any) -> 'Polynomial':
+        if isinstance(other, Polynomial):
+            return other
+        if isinstance(other, (int, float)):
+            return Polynomial.constant(other)
+        raise PolynomialError(f"unable to combine a polynomial with {type(other)}")
+
+    # arithmetic
+    def __add__(self, other: Any) -> 'Polynomial':
+        other = self._coerce(other)
+        variables = _union(self.variables, other.variables)
+        terms = dict(self._extend(variables))
+        for monomial, coefficient in other._extend(variables).items():
+            terms[monomial] = terms.get(monomial, 0) + coefficient
+        return Polynomial(variables, terms)
+
+    __radd__ = __add__
+
+    def __neg__(self) -> 'Polynomial':
+        return Polynomial(self.variables, {monomial: -c for monomial, c in self.terms.items()})
+
+    def __sub__(self, other: Any) -> 'Polynomial':
+        return self + -self._coerce(other)
+
+    def __rsub__(self, other: Any) -> 'Polynomial':
+        return self._coerce(other) + -self
+
+    def __mul__(self, other: Any) -> 'Polynomial':
+        other = self._coerce(other)
+        variables = _union(self.variables, other.variables)
+        right = other._extend(variables).items()
+        terms: dict[Monomial, Number] = {}
+        for left_monomial, left in self._extend(variables).items():
+            for right_monomial, coefficient in right:
+                monomial = tuple(map(operator.add, left_monomial, right_monomial))
+                terms[monomial] = terms.get(monomial, 0) + left * coefficient
+        return Polynomial(variables, terms)
+
+    __rmul__ = __mul__
+
+    def __pow__(self, exponent: int) -> 'Polynomial':
+        return self.power(exponent)
+
+    def power(self, exponent: int, max_terms: int | None = None) -> 'Polynomial':
+        """
+        Raises the polynomial to a power by repeated squaring
+        :param exponent: The exponent, a nonnegative integer
+        :param max_terms: The number of terms of the result and the partial products to give up after, if any
+        :return: The power
+        """
+        if not isinstance(exponent, int) or exponent < 0:
+            raise PolynomialError(f"polynomial exponents must be nonnegative integers, exponent = {exponent}")
+
+        result = Polynomial.constant(1)
+        base = self
+        while exponent:
+            if exponent & 1:
+                result = _limit(result * base, max_terms)
+            exponent >>= 1
+            if exponent:
+                base = _limit(base * base, max_terms)
+        return result
+
+    # calculus
+    def diff(self, variable: str) -> 'Polynomial':
+        """
+        Differentiates the polynomial, term by term
+        :param variable: The variable to differentiate with respect to
+        :return: The derivative
+        """
+        if variable not in self.variables:
+            return Polynomial(self.variables)
+
+        index = self.variables.index(variable)
+        terms = {}
+        for monomial, coefficient in self.terms.items():
+            exponent = monomial[index]
+            if exponent:
+                terms[monomial[:index] + (exponent - 1,) + monomial[index + 1:]] = coefficient * exponent
+        return Polynomial(self.variables, terms)
+
+    def degree(self, variable: str | None = None) -> int:
+        """
+        The highest total degree of the monomials, or the highest exponent of a variable. The zero polynomial has -1
+        """
+        if not self.terms:
+            return -1
+        if variable is None:
+            return max(sum(monomial) for monomial in self.terms)
+        if variable not in self.variables:
+            return 0
+        index = self.variables.index(variable)
+        return max(monomial[index] for monomial in self.terms)
+
+    def evaluate(self, env: Mapping[str, Any]) -> Any:
+        """
+        Evaluates the polynomial, the powers of each variable are computed once
+        :param env: The variable names mapped to their values (or numpy arrays)
+        :return: The value
+        """
+        for name in self.variables:
+            if name not in env:
+                raise PolynomialError(f"unbound variable '{name}'")
+
+        powers: dict[tuple[int, int], Any] = {}
+        total = 0
+        for monomial, coefficient in self.terms.items():
+            value = coefficient
+            for index, exponent in enumerate(monomial):
+                if exponent:
+                    power = powers.get((index, exponent))
+                    if power is None:
+                        power = powers[index, exponent] = env[self.variables[index]] ** exponent
+                    value = value * power
+            total = total + value
+        return total
+
+    # conversion
+    @classmethod
+    def from_node(cls, expression: Expression, max_terms: int | None = None) -> 'Polynomial':
+        """
+        Expands an expression of sums, differences, products, negations, divisions by constants and literal
+        nonnegative integer powers into a polynomial
+        :param expression: The expression
+        :param max_terms: The number of terms of the expansion to give up after, if any
+        :return: The polynomial
+        """
+        # every partial result is over all the variables of the expression, so the exponents are never extended,
+        # and the sums are accumulated into the result of their first operand unless another parent uses it too
+        variables = tuple(sorted(expression.free_variables))
+        positions = {name: index for index, name in enumerate(variables)}
+        order = list(postorder(expression))
+        uses: dict[int, int] = {}
+        for node in order:
+            for child in node.children:
+                uses[id(child)] = uses.get(id(child), 0) + 1
+
+        results: dict[int, Polynomial] = {}
+        for node in order:
+            operands = [results[id(child)] for child in node.children]
+            match node:
+                case literal.Variable():
+                    exponents = [0] * len(variables)
+                    exponents[positions[node.symbol]] = 1
+                    result = cls(variables, {tuple(exponents): 1})
+                case literal.Real():
+                    result = cls(variables, {(0,) * len(variables): node.number})
+                case binary.Add() | nary.Sum() | binary.Sub():
+                    first = node.children[0]
+                    result = operands[0] if uses[id(first)] == 1 else cls(variables, operands[0].terms)
+                    sign = -1 if isinstance(node, binary.Sub) else 1
+                    for operand in operands[1:]:
+                        result._accumulate(operand, sign)
+                case binary.Mul() | nary.Product():
+                    result = operands[0]
+                    for operand in operands[1:]:
+                        result = _limit(result * operand, max_terms)
+                case unary.Negate():
+                    result = -operands[0]
+                case binary.Div():
+                    divisor = operands[1].terms
+                    monomial, number = next(iter(divisor.items()), ((), 0))
+                    if len(divisor) != 1 or any(monomial):
+                        raise PolynomialError("polynomials can only be divided by nonzero constants")
+                    result = Polynomial(operands[0].variables, {
+                        monomial: _divide(coefficient, number) for monomial, coefficient in operands[0].terms.items()
+                    })
+                case binary.Pow():
+                    result = operands[0].power(_exponent(node.right), max_terms)
+                case _:
+                    raise PolynomialError(f"not a polynomial, type(node) = {type(node)}")
+
+            results[id(node)] = _limit(result, max_terms)
+
+        return results[id(expression)]
+
+    def _accumulate(self, other: 'Polynomial', sign: int) -> None:
+        # adds or subtracts a polynomial of the same variables in place
+        terms = self.terms
+        for monomial, coefficient in other.terms.items():
+            total = terms.get(monomial, 0) + sign * coefficient
+            if total == 0:
+                terms.pop(monomial, None)
+            else:
+                terms[monomial] = total
+
+    def to_node(self, exact: bool = False) -> Expression:
+        """
+        Builds the expression of the polynomial, a sum of coefficients times powers of the variables,
+        the terms in increasing degree
+        :param exact: Whether the fractional coefficients are kept exact, the sum over their common denominator,
+            rather than as floats
+        :return: The expression
+        """
+        if exact:
+            denominator = math.lcm(*(c.denominator for c in self.terms.values() if isinstance(c, Fraction)))
+            if denominator != 1:
+                return binary.Div((self * denominator).to_node(), literal.Int(denominator))
+
+        ordered = sorted(self.terms.items(), key=lambda item: (sum(item[0]), tuple(-e for e in item[0])))
+        root = None
+        for monomial, coefficient in ordered:
+            factors: list[Node] = []
+            for name, exponent in zip(self.variables, monomial):
+                if exponent == 1:
+                    factors.append(literal.Variable(name))
+                elif exponent:
+                    factors.append(binary.Pow(literal.Variable(name), literal.Int(exponent)))
+
+            term = _number(coefficient)
+            if factors:
+                term = factors[0] if coefficient == 1 else binary.Mul(term, factors[0])
+                for factor in factors[1:]:
+                    term = binary.Mul(term, factor)
+
+            root = term if root is None else binary.Add(root, term)
+
+        return literal.Int(0) if root is None else root
+
+
+def _union(left: tuple[str, ...], right: tuple[str, ...]) -> tuple[str, ...]:
+    if left == right or not right:
+        return left
+    if not left:
+        return right
+    return tuple(sorted(set(left) | set(right)))
+
+
+def _limit(polynomial: Polynomial, max_terms: int | None) -> Polynomial:
+    if max_terms is not None and len(polynomial.terms) > max_terms:
+        raise PolynomialError(f"polynomial expansion over {max_terms} terms")
+    return polynomial
+
+
+def _divide(coefficient: Number, divisor: Number) -> Number:
+    # integer quotients are kept exact
+    if isinstance(coefficient, (int, Fraction)) and isinstance(divisor, (int, Fraction)):
+        quotient = Fraction(coefficient, divisor)
+        return quotient.numerator if quotient.denominator == 1 else quotient
+    return coefficient / divisor
+
+
+def _number(number: Number) -> Node:
+    if isinstance(number, Fraction):
+        # exact quotients, those that became integral in the arithmetic are integers again
+        if number.denominator == 1:
+            return literal.Int(number.numerator)
+        return literal.Real(float(number))
+    return literal.Int(number) if isinstance(number, int) else literal.Real(number)
+
+
+def _exponent(node: Node) -> int:
+    # only literal exponents, so the degree is known before expanding
+    if not isinstance(node, literal.Real) or not literal.is_natural(node.number):
+        raise PolynomialError("polynomial exponents must be nonnegative integer literals")
+    return int(node.number)
+
+
+def expandable(expression: Expression, min_degree: int, max_terms: int, max_variables: int) -> bool:
+    """
+    Whether the expression is a polynomial of at least the degree that expands into no more terms than it has leaves,
+    or than max_terms. Checked on the cached bounds and variables, so Polynomial.from_node is known to succeed
+    without expanding
+    :param expression: The expression
+    :param min_degree: The lowest total degree worth expanding
+    :param max_terms: The most terms of the expansion
+    :param max_variables: The most variables, as the exponents of every term are kept for each of them
+    :return: Whether it is worth expanding
+    """
+    degree, terms, leaves = expression.polynomial_bounds
+    return degree >= min_degree and terms <= min(leaves, max_terms) and len(expression.free_variables) <= max_variables
+
+
+def expand_polynomials(expression: Expression, min_degree: int = 4, max_terms: int = 1 << 12,
+                       max_variables: int = 16) -> Expression:
+    """
+    Expands the outermost polynomial subtrees worth expanding, see expandable, into sums of monomials.
+    Every node is looked at once, the subtrees of those expanded are not visited
+    :param expression: The expression, which is not modified
+    :param min_degree: The lowest total degree worth expanding
+    :param max_terms: The most terms of an expansion
+    :param max_variables: The most variables of an expansion
+    :return: The expression with the polynomials expanded, the same expression if there are none
+    """
+    def worth(node: Node) -> bool:
+        return expandable(node, min_degree, max_terms, max_variables)
+
+    def visit(node: Node, children: list[Node]) -> Node:
+        if worth(node):
+            return Polynomial.from_node(node).to_node(exact=True)
+        if all(new is old for new, old in zip(children, node.children)):
+            return node
+        return node.with_children(children)
+
+    return fold(expression, visit, leaf=worth)
@@ -0,0 +1,379 @@
+import struct
+from typing import Any, BinaryIO, Iterable, Iterator
+
+from symbols import literal, binary, unary, function, operator, nary
+from symbols.node import Node, Expression
+
+
+class SerializeError(RuntimeError):
+    pass
+
+
+# a postfix expression is a flat tuple of opcodes, the opcodes of leaves and derivatives are followed by their payload
+Postfix = tuple[Any, ...]
+
+# opcodes of the nodes without payload
+_codes: dict[type[Node], str] = {
+    binary.Add: '+',
+    binary.Sub: '-',
+    binary.Mul: '*',
+    binary.Div: '/',
+    binary.Pow: '^',
+    unary.Negate: 'n',
+    function.Sin: 's',
+    function.Cos: 'c',
+    function.Exp: 'e',
+    function.Log: 'l',
+}
+
+_classes: dict[str, type[Node]] = {code: cls for cls, code in _codes.items()}
+_arity: dict[str, int] = {code: 2 if issubclass(cls, binary.Binary) else 1 for cls, code in _codes.items()}
+
+VARIABLE, REAL, INT, DIFF = 'v', 'r', 'i', 'd'
+
+# opcodes of the n-ary nodes, followed by their number of operands
+_nary_codes: dict[type[Node], str] = {
+    nary.Sum: 'S',
+    nary.Product: 'P',
+}
+_nary_classes: dict[str, type[Node]] = {code: cls for cls, code in _nary_codes.items()}
+
+
+def to_postfix(expression: Expression) -> Postfix:
+    """
+    Encodes the expression as a flat postfix tuple, which is hashable and cheap to pickle.
+    Shared subtrees are written out each time
+    :param expression: The expression
+    :return: The postfix tuple
+    """
+    tokens = []
+    stack = [(expression, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+            continue
+
+        match node:
+            case literal.Variable():
+                tokens += VARIABLE, node.symbol
+            case literal.Int():
+                tokens += INT, node.number
+            case literal.Real():
+                tokens += REAL, node.number
+            case operator.Diff():
+                tokens += DIFF, node.regard
+            case nary.NAry():
+                tokens += _nary_codes[type(node)], len(node.children)
+            case _:
+                code = _codes.get(type(node))
+                if code is None:
+                    raise SerializeError(f"cannot serialize node type {type(node)}")
+                tokens.append(code)
+
+    return tuple(tokens)
+
+
+def from_postfix(tokens: Postfix) -> Expression:
+    """
+    Decodes a postfix tuple made by to_postfix
+    :param tokens: The postfix tuple
+    :return: The expression tree
+    """
+    stack: list[Node] = []
+    index = 0
+    try:
+        while index < len(tokens):
+            code = tokens[index]
+            index += 1
+            match code:
+                case 'v':
+                    stack.append(literal.Variable(tokens[index]))
+                    index += 1
+                case 'r':
+                    stack.append(literal.Real(tokens[index]))
+                    index += 1
+                case 'i':
+                    stack.append(literal.Int(tokens[index]))
+                    index += 1
+                case 'd':
+                    stack.append(operator.Diff(stack.pop(), tokens[index]))
+                    index += 1
+                case 'S' | 'P':
+                    arity = tokens[index]
+                    index += 1
+                    if not 0 < arity <= len(stack):
+                        raise IndexError(code)
+                    children = stack[-arity:]
+                    del stack[-arity:]
+                    stack.append(_nary_classes[code](*children))
+                case _:
+                    arity = _arity[code]
+                    if len(stack) < arity:
+                        raise IndexError(code)
+                    children = stack[-arity:]
+                    del stack[-arity:]
+                    stack.append(_classes[code](*children))
+    except (KeyError, IndexError) as error:
+        raise SerializeError(f"malformed postfix expression at {index}") from error
+
+    if len(stack) != 1:
+        raise SerializeError(f"malformed postfix expression, {len(stack)} roots")
+    return stack[0]
+
+
+### binary format ###
+
+# a record is the constant pool followed by the postfix opcodes, leaves and derivatives refer to the pool,
+# nodes are numbered in the order they are completed so equal subtrees are written once and referred to after
+MAGIC = b'SXB\x01'
+
+_OP_VARIABLE, _OP_REAL, _OP_INT, _OP_DIFF, _OP_REF = range(5)
+_op_codes: dict[type[Node], int] = {cls: index for index, cls in enumerate(_codes, 5)}
+_op_classes: list[type[Node] | None] = [None] * 5 + list(_codes)
+_op_binary = [False] * 5 + [issubclass(cls, binary.Binary) for cls in _codes]
+
+# the n-ary nodes come last, followed by their number of operands
+_op_nary: dict[type[Node], int] = {cls: index for index, cls in enumerate(_nary_codes, len(_op_classes))}
+_OP_NARY = len(_op_classes)
+_op_classes += _nary_codes
+_op_binary += [False] * len(_nary_codes)
+
+_POOL_STR, _POOL_FLOAT, _POOL_INT = range(3)
+_double = struct.Struct('<d')
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = data[position]
+    position += 1
+    if value < 0x80:
+        return value, position
+
+    value &= 0x7f
+    shift = 7
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def to_bytes(expression: Expression) -> bytes:
+    """
+    Encodes the expression into the compact binary format, structurally equal subtrees are written once.
+    The encoding is canonical, equal expressions give the same bytes whether or not their subtrees are shared
+    :param expression: The expression
+    :return: The encoded record
+    """
+    pool: dict[Any, int] = {}
+    pool_data = bytearray()
+    ops = bytearray()
+
+    def constant(key: Any, tag: int, value: Any) -> int:
+        index = pool.get(key)
+        if index is None:
+            index = pool[key] = len(pool)
+            pool_data.append(tag)
+            if tag == _POOL_STR:
+                encoded = value.encode()
+                _write_varint(pool_data, len(encoded))
+                pool_data.extend(encoded)
+            elif tag == _POOL_FLOAT:
+                pool_data.extend(_double.pack(value))
+            else:
+                # zigzag, so small negative integers stay short
+                _write_varint(pool_data, value * 2 if value >= 0 else -value * 2 - 1)
+        return index
+
+    # the numbers of the written structures, by their class, data and the numbers of their children,
+    # and of the visited nodes, so a shared node is referred to without visiting it again
+    structures: dict[tuple, int] = {}
+    numbers: dict[int, int] = {}
+    stack: list[tuple[Node, int]] = [(expression, -1)]
+    while stack:
+        node, start = stack.pop()
+        if start < 0:
+            number = numbers.get(id(node))
+            if number is not None:
+                ops.append(_OP_REF)
+                _write_varint(ops, number)
+            else:
+                stack.append((node, len(ops)))
+                if node.children:
+                    stack.extend((child, -1) for child in reversed(node.children))
+            continue
+
+        key = (node.__class__, node.data, *(numbers[id(child)] for child in node.children))
+        number = structures.get(key)
+        if number is not None:
+            # an equal subtree is written already, the operands written for this one are references
+            # to its parts, so they are replaced by a reference to it
+            del ops[start:]
+            ops.append(_OP_REF)
+            _write_varint(ops, number)
+            numbers[id(node)] = number
+            continue
+
+        cls = type(node)
+        code = _op_codes.get(cls)
+        if code is not None:
+            ops.append(code)
+        else:
+            if cls is literal.Variable:
+                code, index = _OP_VARIABLE, constant(node.symbol, _POOL_STR, node.symbol)
+            elif cls is operator.Diff:
+                code, index = _OP_DIFF, constant(node.regard, _POOL_STR, node.regard)
+            elif cls in _op_nary:
+                code, index = _op_nary[cls], len(node.children)
+            elif isinstance(node, literal.Real):
+                code = _OP_INT if isinstance(node, literal.Int) else _OP_REAL
+                value = node.number
+                if isinstance(value, float):
+                    # the bytes tell apart 0.0 and -0.0
+                    index = constant((float, _double.pack(value)), _POOL_FLOAT, value)
+                elif isinstance(value, int):
+                    index = constant((int, value), _POOL_INT, int(value))
+                else:
+                    raise SerializeError(f"cannot serialize number type {type(value)}")
+            else:
+                raise SerializeError(f"cannot serialize node type {cls}")
+
+            ops.append(code)
+            if index < 0x80:
+                ops.append(index)
+            else:
+                _write_varint(ops, index)
+
+        numbers[id(node)] = structures[key] = len(structures)
+
+    out = bytearray()
+    _write_varint(out, len(pool))
+    out += pool_data
+    out += ops
+    return bytes(out)
+
+
+def from_bytes(data: bytes) -> Expression:
+    """
+    Decodes a record made by to_bytes, shared subtrees are decoded into shared nodes
+    :param data: The encoded record
+    :return: The expression
+    """
+    try:
+        count, position = _read_varint(data, 0)
+        pool = []
+        for _ in range(count):
+            tag = data[position]
+            position += 1
+            if tag == _POOL_STR:
+                length, position = _read_varint(data, position)
+                pool.append(data[position:position + length].decode())
+                position += length
+            elif tag == _POOL_FLOAT:
+                pool.append(_double.unpack_from(data, position)[0])
+                position += 8
+            elif tag == _POOL_INT:
+                value, position = _read_varint(data, position)
+                pool.append(value >> 1 if not value & 1 else -(value >> 1) - 1)
+            else:
+                raise SerializeError(f"unknown constant tag {tag}")
+
+        stack: list[Node] = []
+        nodes: list[Node] = []
+        end = len(data)
+        while position < end:
+            code = data[position]
+            position += 1
+            if code == _OP_REF:
+                number, position = _read_varint(data, position)
+                stack.append(nodes[number])
+                continue
+
+            if code < _OP_REF:
+                index, position = _read_varint(data, position)
+                if code == _OP_VARIABLE:
+                    node = literal.Variable(pool[index])
+                elif code == _OP_REAL:
+                    node = literal.Real(pool[index])
+                elif code == _OP_INT:
+                    node = literal.Int(pool[index])
+                else:
+                    node = operator.Diff(stack.pop(), pool[index])
+            elif code >= _OP_NARY:
+                count, position = _read_varint(data, position)
+                if not 0 < count <= len(stack):
+                    raise SerializeError(f"malformed binary expression, {count} operands")
+                node = _op_classes[code](*stack[-count:])
+                del stack[-count:]
+            elif _op_binary[code]:
+                right = stack.pop()
+                node = _op_classes[code](stack.pop(), right)
+            else:
+                node = _op_classes[code](stack.pop())
+
+            stack.append(node)
+            nodes.append(node)
+    except (IndexError, struct.error, UnicodeDecodeError) as error:
+        raise SerializeError("malformed binary expression") from error
+
+    if len(stack) != 1:
+        raise SerializeError(f"malformed binary expression, {len(stack)} roots")
+    return stack[0]
+
+
+def write_expressions(stream: BinaryIO, expressions: Iterable[Expression]) -> int:
+    """
+    Writes the expressions to a binary stream, one length prefixed record after the other
+    :param stream: The stream, at the start of the file
+    :param expressions: The expressions
+    :return: The number of expressions written
+    """
+    stream.write(MAGIC)
+    count = 0
+    for expression in expressions:
+        record = to_bytes(expression)
+        prefix = bytearray()
+        _write_varint(prefix, len(record))
+        stream.write(prefix)
+        stream.write(record)
+        count += 1
+    return count
+
+
+def read_expressions(stream: BinaryIO) -> Iterator[Expression]:
+    """
+    Reads the expressions written by write_expressions one at a time
+    :param stream: The stream, at the start of the file
+    :return: The expressions
+    """
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise SerializeError("not an expression stream")
+
+    while True:
+        # the length prefix, a byte at a time
+        length, shift = 0, 0
+        while True:
+            byte = stream.read(1)
+            if not byte:
+                if shift:
+                    raise SerializeError("truncated expression stream")
+                return
+            length |= (byte[0] & 0x7f) << shift
+            shift += 7
+            if byte[0] < 0x80:
+                break
+
+        record = stream.read(length)
+        if len(record) != length:
+            raise SerializeError("truncated expression stream")
+        yield from_bytes(record)
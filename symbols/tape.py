@@ -0,0 +1,187 @@
+from array import array
+from typing import Any
+
+from symbols import binary, literal, function, operator, unary, nary
+from symbols.node import Node, Expression, postorder, template_pieces
+
+# the node classes by opcode, leaves and derivatives first
+CLASSES: tuple[type[Node], ...] = (
+    literal.Variable, literal.Real, literal.Int, operator.Diff,
+    binary.Add, binary.Sub, binary.Mul, binary.Div, binary.Pow,
+    unary.Negate, function.Sin, function.Cos, function.Exp, function.Log,
+)
+
+VARIABLE, REAL, INT, DIFF = range(4)
+OPCODES: dict[type[Node], int] = {cls: code for code, cls in enumerate(CLASSES)}
+ARITY: tuple[int, ...] = tuple(
+    0 if code < DIFF else 2 if issubclass(cls, binary.Binary) else 1 for code, cls in enumerate(CLASSES)
+)
+
+
+_templates = {code: template_pieces(cls.symbol) for code, cls in enumerate(CLASSES) if code > DIFF}
+_precedences = tuple(cls.precedence for cls in CLASSES)
+
+
+class Tape:
+    """
+    An expression as parallel arrays in post-order, each distinct node once so shared subtrees stay shared.
+    An entry is an opcode and two operands, the indices of the children, of the variable name or of the constant.
+    A derivative has its child first and its variable name second. Children come before their parents and the
+    root is the last entry
+    """
+
+    opcodes: array  # the opcode of every entry
+    first: array  # the first child, or the index of the name or the constant of a leaf
+    second: array  # the second child, or the name index of a derivative variable
+    names: list[str]
+    constants: list[Any]
+
+    def __init__(self) -> None:
+        self.opcodes = array('B')
+        self.first = array('i')
+        self.second = array('i')
+        self.names = []
+        self.constants = []
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the arrays in bytes, without the names and constants
+        """
+        return sum(a.itemsize * len(a) for a in (self.opcodes, self.first, self.second))
+
+    @classmethod
+    def from_node(cls, expression: Expression) -> 'Tape':
+        """
+        Flattens the expression, subtrees shared by several parents are written once.
+        The n-ary sums and products are written as left aligned chains of binary entries
+        :param expression: The expression
+        :return: The tape
+        """
+        tape = cls()
+        indices: dict[int, int] = {}
+        names: dict[str, int] = {}
+        constants: dict[Any, int] = {}
+
+        for node in postorder(expression):
+            if isinstance(node, nary.NAry):
+                operands = node.children
+                first = indices[id(operands[0])]
+                code = OPCODES[node.chain]
+                for operand in operands[1:]:
+                    tape.opcodes.append(code)
+                    tape.first.append(first)
+                    tape.second.append(indices[id(operand)])
+                    first = len(tape.opcodes) - 1
+                indices[id(node)] = first
+                continue
+
+            code = OPCODES.get(type(node))
+            if code is None:
+                raise TypeError(f"unsupported node type, {type(node)}")
+
+            first = second = -1
+            if code == VARIABLE:
+                first = names.setdefault(node.symbol, len(names))
+            elif code == REAL or code == INT:
+                # the repr tells apart 0.0 and -0.0, and the type 2 and 2.0
+                first = constants.setdefault((type(node.number), repr(node.number)), len(constants))
+                if first == len(tape.constants):
+                    tape.constants.append(node.number)
+            elif code == DIFF:
+                first = indices[id(node.children[0])]
+                second = names.setdefault(node.regard, len(names))
+            else:
+                first = indices[id(node.children[0])]
+                if ARITY[code] == 2:
+                    second = indices[id(node.children[1])]
+
+            indices[id(node)] = len(tape.opcodes)
+            tape.opcodes.append(code)
+            tape.first.append(first)
+            tape.second.append(second)
+
+        tape.names = list(names)
+        return tape
+
+    def to_node(self) -> Expression:
+        """
+        Rebuilds the expression, shared entries become shared nodes
+        :return: The expression
+        """
+        nodes: list[Node] = []
+        for code, first, second in zip(self.opcodes, self.first, self.second):
+            if code == VARIABLE:
+                node = literal.Variable(self.names[first])
+            elif code == REAL:
+                node = literal.Real(self.constants[first])
+            elif code == INT:
+                node = literal.Int(self.constants[first])
+            elif code == DIFF:
+                node = operator.Diff(nodes[first], self.names[second])
+            elif ARITY[code] == 2:
+                node = CLASSES[code](nodes[first], nodes[second])
+            else:
+                node = CLASSES[code](nodes[first])
+            nodes.append(node)
+        return nodes[-1]
+
+    def reachable(self, root: int) -> list[int]:
+        """
+        Returns the indices of the entries in the subtree of an entry, in order
+        """
+        seen = bytearray(root + 1)
+        seen[root] = 1
+        for index in range(root, -1, -1):
+            if seen[index]:
+                code = self.opcodes[index]
+                if ARITY[code] >= 1:
+                    seen[self.first[index]] = 1
+                if ARITY[code] == 2:
+                    seen[self.second[index]] = 1
+        return [index for index in range(root + 1) if seen[index]]
+
+    def as_display(self) -> str:
+        """
+        Prints the expression the same as Node.as_display, in a single pass writing each piece once
+        """
+        out: list[str] = []
+        # pieces still to write, an entry index is printed in place and a string is written as is
+        stack: list[str | int] = [len(self.opcodes) - 1]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+                continue
+
+            code = self.opcodes[item]
+            if code == VARIABLE:
+                out.append(self.names[self.first[item]])
+                continue
+            if code == REAL or code == INT:
+                out.append(f"{self.constants[self.first[item]]}")
+                continue
+
+            if code == DIFF:
+                pieces = ('d/d' + self.names[self.second[item]] + ' ', 0, '')
+            else:
+                pieces = _templates[code]
+
+            precedence = _precedences[code]
+            children = (self.first[item], self.second[item])
+            for piece in reversed(pieces):
+                if isinstance(piece, str):
+                    if piece:
+                        stack.append(piece)
+                    continue
+
+                child = children[piece]
+                if _precedences[self.opcodes[child]] < precedence:
+                    stack += ')', child, '('
+                else:
+                    stack.append(child)
+
+        return ''.join(out)
@@ -1,9 +1,10 @@
-from symbols.node import Node, NodePrecedence
+from symbols.node import NodePrecedence, UnaryNode
 
 
-class Negate(Node):
+class Negate(UnaryNode):
+    __slots__ = ()
+    symbol = '-%0'
     precedence = NodePrecedence.UNARY
 
-    def __init__(self, node: Node) -> None:
-        super().__init__([node], '-%0')
-
+    def _compute_polynomial(self) -> tuple[int, int, int]:
+        return self._child._polynomial
@@ -1,11 +1,42 @@
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
 
 import symbols.literal as lit
 import symbols.binary as bi
 import symbols.function as fn
+import main
+from executor.batch import simplify_many
+from symbols.cache import LRUCache
+from executor.compiler import compile_expression, CompileError
+from executor.cse import eliminate_common_subexpressions, evaluate_bindings, display_bindings, inline, share
+from executor.vectorized import evaluate_array, np
+from executor.derivative import DerivativeTower, nth_derivative, hessian
+from executor.gradient import gradient
+from executor.evaluator import interpret_expression, evaluate, partial_evaluate, forward_derivative, EvaluatorError, \
+    evaluate_tape
+from executor.rule import Rule, RuleApplier
+import executor.batch
+import executor.store
+from executor.store import ResultStore, rule_fingerprint
+from executor.rules.diff import diffrules, PolynomialRule
+from executor.rules.simple import simplerules
 from executor.simplify import simplify_expression
-from symbols import operator, function, make, unary
-from symbols.overload import overload, as_expression
+from symbols import operator, function, make, unary, nary
+from symbols.intern import NodeFactory
+from symbols.node import ImmutableNodeError, postorder, display_cache
+from symbols.overload import overload, as_expression, as_expression_ast
+from symbols.parser import parse, ParseError
+from symbols.polynomial import Polynomial, PolynomialError
+from symbols.tape import Tape
+from symbols.serialize import to_postfix, from_postfix, to_bytes, from_bytes, read_expressions, write_expressions, \
+    SerializeError
 
 
 class TestSimplification(unittest.TestCase):
@@ -22,7 +53,7 @@ class TestSimplification(unittest.TestCase):
 
     def test_reorder_rule(self):
         expression = '2 * x * 2 + (2 + 4) + 3 * 3 + a + b + c'
-        expected = '15 + 4 * x + a + b + c'
+        expected = '15 + a + b + c + 4 * x'
         self.assertEqual(
             simplify_expression(as_expression(expression)).as_display(),
             as_expression(expected).as_display()
@@ -46,12 +77,68 @@ class TestSimplification(unittest.TestCase):
         expected = '2.0 + b + c + d'
         self.__assertSimpExpression(expression, expected)
 
+    def test_cancel_inner(self):
+        expression = 'a + x + b - x'
+        expected = 'a + b'
+        self.__assertSimpExpression(expression, expected)
+
     def test_leftorder(self):
         expression = "(a + (b - c)) + (d * (e / f))"
-        expected = 'a + b - c + d * e / f'
+        expected = 'a + b + d * e / f - c'
         self.__assertSimpExpression(expression, expected)
 
 
+    def test_dispatch(self):
+        applier = RuleApplier([*simplerules, *diffrules])
+        self.assertEqual(applier.rules_for(lit.Variable), [])
+        self.assertEqual(applier.rules_for(lit.Int), [])
+        self.assertTrue(all(rule.types == (operator.Diff,) for rule in applier.rules_for(operator.Diff)))
+        self.assertEqual(
+            [rule.id for rule in applier.rules_for(bi.Mul)],
+            sorted(rule.id for rule in applier.rules_for(bi.Mul))
+        )
+
+    def test_normal_form(self):
+        simplified = simplify_expression(as_expression('dx(x ** 3) + a * 2'), cache=None)
+        self.assertIsNotNone(simplified.normal_under)
+        self.assertIs(simplify_expression(simplified, cache=None), simplified)
+
+        # the marker of a node is forgotten once one of its descendants is replaced
+        expression = simplify_expression(as_expression('a * b + c', cache=None), cache=None)
+        self.assertEqual(expression.as_display(), 'c + a * b')
+        self.assertIs(simplify_expression(expression, cache=None), expression)
+        expression.right.right = lit.Real(0.0)
+        self.assertEqual(simplify_expression(expression, cache=None).as_display(), 'c')
+
+    def test_shared_results(self):
+        # the cached results are handed out as copies, so modifying one changes neither the cache nor the others
+        cache = LRUCache()
+        first = simplify_expression(as_expression('dx(sin(x) * y)'), cache=cache)
+        second = simplify_expression(as_expression('dx(sin(x) * y)'), cache=cache)
+        self.assertIsNot(first, second)
+        self.assertGreater(cache.hits, 0)
+        displayed = second.as_display()
+        first.right = lit.Variable('q')
+        self.assertEqual(second.as_display(), displayed)
+        self.assertEqual(simplify_expression(as_expression('dx(sin(x) * y)'), cache=cache).as_display(), displayed)
+
+    def test_loop(self):
+        class SwapRule(Rule):
+            types = (bi.Add,)
+
+            def match(self, expression):
+                return True
+
+            def apply(self, expression):
+                return bi.Add(expression.right, expression.left)
+
+        loops = []
+        applier = RuleApplier([SwapRule()], on_loop=lambda expression, rule: loops.append(expression))
+        changed, result = applier.apply(as_expression('a + b'))
+        self.assertTrue(changed)
+        self.assertEqual(result.as_display(), 'b + a')
+        self.assertEqual(len(loops), 1)
+
     def __assertSimpExpression(self, expression: str, expected: str):
         self.assertEqual(
             as_expression(expected).as_display(),
@@ -82,6 +169,34 @@ class TestAsExpression(unittest.TestCase):
             expected.as_display()
         )
 
+
+class TestParser(unittest.TestCase):
+    def test_same_trees(self):
+        for text in ['-a ** -b ** c', 'a - b - c / d / e', '2 ** 3 ** x', '-x * y + -(x - 1.5e3)',
+                     'dx(SIN(x) * cos(log(exp(.5 * x_1))))', '1_000 + 2. / x', '((x))', '+x ** 2']:
+            expected = as_expression_ast(text.replace('+x', 'x'))
+            self.assertEqual(parse(text), expected, msg=text)
+            self.assertEqual(parse(text).as_display(), expected.as_display(), msg=text)
+
+    def test_errors(self):
+        for text in ['x +', '(x', 'x)', 'f(x)', 'sin(x, y)', 'x y', '', 'x % 2', 'lambda', '2x']:
+            with self.assertRaises(ParseError, msg=text):
+                parse(text)
+
+    def test_deep(self):
+        self.assertEqual(len(parse('(' * 5000 + 'x' + ')' * 5000).as_display()), 1)
+        self.assertEqual(parse(' + '.join(['x'] * 5000)).as_display(), ' + '.join(['x'] * 5000))
+
+    def test_cache(self):
+        cache = LRUCache()
+        first = as_expression('x * y', cache)
+        self.assertIs(as_expression('x * y', cache), first)
+        self.assertEqual(cache.hits, 1)
+        with self.assertRaises(ImmutableNodeError):
+            first.left = lit.Variable('z')
+        self.assertIsNot(as_expression('x * y', None), as_expression('x * y', None))
+
+
 class TestDifferentiation(unittest.TestCase):
     def setUp(self) -> None:
         overload()
@@ -93,7 +208,7 @@ class TestDifferentiation(unittest.TestCase):
 
     def test_arithmetic(self):
         expression = 'dx(x ** 2 + x ** 3 + z * x + x / x)'
-        expected = '2 * x + 3 * x ** 2 + z'
+        expected = 'z + 2 * x + 3 * x ** 2'
         self.__assertDiffExpression(expression, expected)
 
     def __assertDiffExpression(self, expression: str, expected: str):
@@ -103,5 +218,721 @@ class TestDifferentiation(unittest.TestCase):
         )
 
 
+class TestEquality(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_structural(self):
+        self.assertEqual(as_expression('sin(x) * 2 + y'), as_expression('sin(x) * 2 + y'))
+        self.assertEqual(hash(as_expression('sin(x) * 2 + y')), hash(as_expression('sin(x) * 2 + y')))
+        self.assertNotEqual(as_expression('x + 2'), as_expression('x + 2.0'))
+        self.assertNotEqual(as_expression('dx(x)'), as_expression('dy(x)'))
+
+    def test_keys(self):
+        seen = {as_expression('a * b'), as_expression('a * b'), as_expression('b * a')}
+        self.assertEqual(len(seen), 2)
+
+    def test_metadata(self):
+        expression = as_expression('sin(x) * y + dz(2 * z)')
+        self.assertEqual(expression.free_variables, {'x', 'y', 'z'})
+        self.assertTrue(expression.has_diff)
+        self.assertFalse(expression.left.has_diff)
+        self.assertTrue(as_expression('exp(2) / 3').is_constant)
+        self.assertFalse(as_expression('dx(2)').is_constant)
+
+    def test_modified(self):
+        node = as_expression('a + b', cache=None)
+        before = hash(node)
+        node.right = lit.Variable('a')
+        self.assertEqual(node, as_expression('a + a'))
+        self.assertNotEqual(hash(node), before)
+
+        # replacing a grandchild outdates the cached values of the ancestors too
+        tree, other = as_expression('(x + y) * z', cache=None), as_expression('(x + q) * z', cache=None)
+        self.assertNotEqual(tree, other)
+        self.assertEqual(tree.free_variables, {'x', 'y', 'z'})
+        tree.left.right = lit.Variable('q')
+        self.assertEqual(tree, other)
+        self.assertIn(tree, {other})
+        self.assertEqual(tree.free_variables, {'x', 'q', 'z'})
+
+
+class TestNodes(unittest.TestCase):
+    def test_slots(self):
+        expression = as_expression('dx(sin(x) * -y ** 2.5 + 3) / cos(z) - exp(log(w))', cache=None)
+        for node in postorder(expression):
+            self.assertFalse(hasattr(node, '__dict__'), msg=type(node))
+
+    def test_children(self):
+        expression = as_expression('dx(sin(x) * -y)', cache=None)
+        product = expression.expression
+        self.assertEqual(product.children, (product.left, product.right))
+        self.assertEqual(product.right.expression, lit.Variable('y'))
+
+        product.right.expression = lit.Variable('z')
+        product.left = lit.Real(2.0)
+        self.assertEqual(expression.as_display(), 'd/dx (2.0 * -z)')
+        self.assertEqual(expression.symbol, 'd/dx %0')
+        with self.assertRaises(IndexError):
+            product.set_child(2, lit.Variable('a'))
+
+    def test_display(self):
+        expression = as_expression('-(a - b) / (c * d) ** (e ** f) - sin(x + 1) * dx(y - -z)', cache=None)
+        self.assertEqual(expression.as_display(), '-(a - b) / (c * d) ^ e ^ f - sin (x + 1) * d/dx (y - -z)')
+        self.assertEqual(as_expression('a * (b + c)', cache=None).as_symbol(), '( a ) * ( ( b ) + ( c ) )')
+        self.assertEqual(bi.Add(lit.Real(0.0), lit.Real(-0.0)).as_display(), '0.0 + -0.0')
+
+        stream = io.StringIO()
+        expression.write_display(stream, buffer=2)
+        self.assertEqual(stream.getvalue(), expression.as_display())
+
+    def test_display_memoized(self):
+        expression = as_expression('a * b + -0.0')
+        self.assertTrue(expression.frozen)
+        displayed = expression.as_display()
+        self.assertIs(expression.as_display(), displayed)
+        self.assertIn(id(expression), display_cache)
+
+        # structurally equal trees may print differently, so the memo is per node
+        self.assertEqual(as_expression('a * b + 0.0').as_display(), 'a * b + 0.0')
+        self.assertEqual(bi.Mul(expression, lit.Variable('c')).as_display(), '(a * b + -0.0) * c')
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_reuse(self):
+        cache = LRUCache()
+        first = simplify_expression(as_expression('dx(sin(x)) + a'), cache=cache)
+        hits = cache.hits
+        second = simplify_expression(as_expression('dx(sin(x)) * b'), cache=cache)
+        self.assertGreater(cache.hits, hits)
+        self.assertEqual(first.as_display(), 'a + cos x')
+        self.assertEqual(second.as_display(), 'b * cos x')
+
+        misses = cache.misses
+        simplify_expression(as_expression('dx(sin(x)) + a'), cache=cache)
+        self.assertEqual(cache.misses, misses)
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        for expression in ['a + b', 'b + c', 'c + d']:
+            simplify_expression(as_expression(expression), cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_persistent(self):
+        expression = as_expression('dx(x ** 3 * sin(x))')
+        expected = simplify_expression(expression)
+        with ResultStore(self.directory.name) as store:
+            self.assertEqual(simplify_expression(expression, store=store), expected)
+            self.assertEqual((store.hits, store.misses, len(store)), (0, 1, 1))
+
+        with ResultStore(self.directory.name) as store:
+            self.assertEqual(simplify_expression(expression, cache=None, store=store), expected)
+            self.assertEqual((store.hits, len(store)), (1, 1))
+
+            # an equal input with shared subtrees is the same entry
+            inner = as_expression('x ** 3', cache=None)
+            product = bi.Mul(inner, inner)
+            simplify_expression(product, cache=None, store=store)
+            simplify_expression(bi.Mul(inner, inner.copy()), cache=None, store=store)
+            self.assertEqual((store.hits, len(store)), (2, 2))
+
+            class NoRule(Rule):
+                def match(self, expression):
+                    return False
+
+                def apply(self, expression):
+                    return expression
+
+            # another rule set has its own entries
+            simplify_expression(expression, [NoRule()], store=store)
+            self.assertEqual((store.hits, len(store)), (2, 3))
+
+    def test_fingerprint(self):
+        self.assertEqual(rule_fingerprint([*simplerules, *diffrules]), rule_fingerprint([*simplerules, *diffrules]))
+        self.assertNotEqual(rule_fingerprint(simplerules), rule_fingerprint([*simplerules, *diffrules]))
+
+        # any change of the package sources, the evaluator or the polynomials too, gives a new fingerprint
+        fingerprint = rule_fingerprint(simplerules)
+        digest = executor.store._package_sources()
+        try:
+            executor.store._fingerprints.clear()
+            executor.store._package_digest = b'changed'
+            self.assertNotEqual(rule_fingerprint(simplerules), fingerprint)
+        finally:
+            executor.store._fingerprints.clear()
+            executor.store._package_digest = digest
+
+    def test_replace(self):
+        with ResultStore(self.directory.name) as store:
+            fingerprint = rule_fingerprint(simplerules)
+            for index in range(3):
+                store.put(fingerprint, lit.Variable('x'), lit.Real(index))
+            self.assertEqual(len(store), 1)
+            self.assertEqual(store.get(fingerprint, lit.Variable('x')), lit.Real(2))
+
+    def test_evict(self):
+        with ResultStore(self.directory.name, max_entries=10) as store:
+            fingerprint = rule_fingerprint(simplerules)
+            for index in range(30):
+                store.put(fingerprint, lit.Real(index), lit.Real(index))
+                store.get(fingerprint, lit.Real(0))
+            self.assertLessEqual(len(store), 10)
+            self.assertEqual(store.get(fingerprint, lit.Real(0)), lit.Real(0))
+            self.assertIsNone(store.get(fingerprint, lit.Real(1)))
+
+
+class TestIntern(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_sharing(self):
+        factory = NodeFactory()
+        left = factory.intern(as_expression('sin(x) * 2'))
+        right = factory.intern(as_expression('sin(x) * 2'))
+        self.assertIs(left, right)
+        self.assertIs(left.left.expression, factory.make(lit.Variable, 'x'))
+        self.assertIsNot(factory.make(lit.Int, 2), factory.make(lit.Real, 2.0))
+        self.assertIsNot(factory.make(lit.Real, 0.0), factory.make(lit.Real, -0.0))
+        self.assertNotEqual(lit.Real(0.0), lit.Real(-0.0))
+
+        # the simplify cache keeps them apart as well
+        cache = LRUCache()
+        self.assertEqual(simplify_expression(unary.Negate(lit.Real(0.0)), cache=cache).as_display(), '-0.0')
+        self.assertEqual(simplify_expression(unary.Negate(lit.Real(-0.0)), cache=cache).as_display(), '0.0')
+
+    def test_frozen(self):
+        node = NodeFactory().intern(as_expression('a + b'))
+        with self.assertRaises(ImmutableNodeError):
+            node.left = lit.Variable('c')
+
+    def test_simplify(self):
+        factory = NodeFactory()
+        expression = as_expression('dx(2**x * sin(x) / cos(2*x))')
+        expected = simplify_expression(expression.copy()).as_display()
+        self.assertEqual(
+            simplify_expression(expression, factory=factory).as_display(),
+            expected
+        )
+        # the input is not modified
+        self.assertEqual(expression.as_display(), as_expression('dx(2**x * sin(x) / cos(2*x))').as_display())
+
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_evaluate(self):
+        expression = as_expression('a * sin(x) + b ** 2')
+        self.assertAlmostEqual(evaluate(expression, {'a': 2.0, 'x': 1.0, 'b': 3.0}), 2.0 * math.sin(1.0) + 9.0)
+        with self.assertRaises(EvaluatorError):
+            evaluate(expression, {'a': 2.0})
+
+    def test_partial(self):
+        expression = as_expression('a * sin(b * x) + exp(c) * x')
+        residual = partial_evaluate(expression, {'a': 2.0, 'b': 3.0, 'c': 0.0})
+        self.assertEqual(residual.as_display(), '2.0 * sin (3.0 * x) + 1.0 * x')
+        self.assertAlmostEqual(
+            evaluate(residual, {'x': 0.5}),
+            evaluate(expression, {'a': 2.0, 'b': 3.0, 'c': 0.0, 'x': 0.5})
+        )
+
+    def test_partial_diff(self):
+        expression = as_expression('dx(a * x * x) + a')
+        residual = partial_evaluate(expression, {'a': 2.0, 'x': 1.0})
+        self.assertEqual(residual.as_display(), '6.0')
+
+        # the derivative variable is bound but the expression is not closed
+        expression = as_expression('dx(a * x * x * y) + a')
+        residual = partial_evaluate(expression, {'a': 2.0, 'x': 1.0})
+        self.assertEqual(residual.free_variables, {'y'})
+        self.assertAlmostEqual(evaluate(residual, {'y': 3.0}), evaluate(expression, {'a': 2.0, 'x': 1.0, 'y': 3.0}))
+
+        # the derivative variable is free
+        residual = partial_evaluate(as_expression('dx(a * x) + a'), {'a': 2.0})
+        self.assertEqual(residual.as_display(), 'd/dx (2.0 * x) + 2.0')
+
+    def test_partial_untouched(self):
+        expression = as_expression('sin(x) * y')
+        self.assertIs(partial_evaluate(expression, {'z': 1.0}), expression)
+
+
+class TestForward(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_against_symbolic(self):
+        env = {'x': 0.7, 'y': 1.3}
+        for expression in ['dx(x ** 3 * sin(x))', 'dx(x ** x)', 'dx(2**x * sin(x) / cos(2*x))',
+                           'dx(log(exp(x) * y) - -x)', 'dy(x ** y)']:
+            self.assertAlmostEqual(
+                evaluate(as_expression(expression), env),
+                evaluate(simplify_expression(as_expression(expression)), env, diff=None),
+                msg=expression
+            )
+
+    def test_nested(self):
+        self.assertAlmostEqual(evaluate(as_expression('dx(dx(x ** 3))'), {'x': 0.7}), 6 * 0.7)
+        self.assertAlmostEqual(evaluate(as_expression('dx(dy(x * y * x))'), {'x': 0.7, 'y': 2.0}), 2 * 0.7)
+
+    def test_value(self):
+        self.assertEqual(forward_derivative(as_expression('x ** 2 + y'), 'x', {'x': 3.0, 'y': 1.0}), (10.0, 6.0))
+        with self.assertRaises(TypeError):
+            evaluate(as_expression('dx(x)'), {'x': 1.0}, diff=None)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_vectorized(self):
+        x = np.linspace(0.0, 1.0, 5)
+        self.assertTrue(np.allclose(evaluate(as_expression('dx(x ** 3 * y)'), {'x': x, 'y': 2.0}), 6 * x ** 2))
+
+
+class TestGradient(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_numeric(self):
+        env = {'x': 0.7, 'y': 1.3, 'z': 2.1}
+        expression = as_expression('sin(x * y) / z + x ** y - log(z) * exp(-x) + 3 ** 2')
+        for variable, value in zip('xyz', gradient(expression, 'xyz', env)):
+            self.assertAlmostEqual(value, forward_derivative(expression, variable, env)[1], msg=variable)
+
+    def test_negative_base(self):
+        # the exponent partial is not wanted, so the log of the negative base is never taken
+        self.assertEqual(gradient(as_expression('x ** n'), ['x'], {'x': -2.0, 'n': 3.0}), [12.0])
+
+    def test_symbolic(self):
+        env = {'x': 0.7, 'y': 1.3}
+        expression = as_expression('cos(x * y) * (x * y) + y ** 3')
+        derivatives = gradient(expression, ['x', 'y', 'w'])
+        self.assertEqual(derivatives[2].as_display(), '0.0')
+        for variable, derivative in zip('xy', derivatives):
+            self.assertAlmostEqual(evaluate(derivative, env), forward_derivative(expression, variable, env)[1])
+        self.assertEqual(simplify_expression(gradient(as_expression('x * y + x'), ['x'])[0]).as_display(), '1.0 + y')
+
+    def test_shared(self):
+        inner = as_expression('sin(x * y)')
+        derivative = gradient(bi.Mul(inner, inner), ['x'])[0]
+        self.assertTrue(any(node is inner for node in postorder(derivative)))
+        with self.assertRaises(EvaluatorError):
+            gradient(as_expression('dx(x)'), ['x'], {'x': 1.0})
+
+
+class TestDerivativeTower(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_nth(self):
+        self.assertEqual(nth_derivative(as_expression('x ** 3'), 'x', 3).as_display(), '6.0')
+        self.assertEqual(nth_derivative(as_expression('x ** 3'), 'x', 4).as_display(), '0.0')
+        self.assertEqual(nth_derivative(as_expression('x * y'), 'x', 0).as_display(), 'x * y')
+
+        env = {'x': 0.7}
+        tower = DerivativeTower(as_expression('sin(x) * exp(x)'))
+        for order in range(1, 4):
+            expected = evaluate(as_expression('dx(' * order + 'sin(x) * exp(x)' + ')' * order), env)
+            self.assertAlmostEqual(evaluate(tower.nth('x', order), env), expected, msg=order)
+
+    def test_hessian(self):
+        env = {'x': 0.7, 'y': 1.3, 'z': 2.0}
+        expression = as_expression('x ** 2 * y + sin(x * z) - y ** 3')
+        tower = DerivativeTower(expression)
+        matrix = tower.hessian('xyz')
+        for row, first in enumerate('xyz'):
+            for column, second in enumerate('xyz'):
+                nested = operator.Diff(operator.Diff(expression, first), second)
+                self.assertAlmostEqual(evaluate(matrix[row][column], env), evaluate(nested, env))
+        self.assertIs(matrix[0][1], matrix[1][0])
+        self.assertIs(tower.derivative('z', 'x'), matrix[0][2])
+        self.assertEqual(hessian(as_expression('x * y'), 'xy')[0][1].as_display(), '1.0')
+
+
+class TestBatch(unittest.TestCase):
+    EXPRESSIONS = ['dx(x ** 3 * sin(x))', 'x + x + 1', 'dy(x * y ** 2)', 'x + x + 1', 'dx(log(-x) / 2)', '3 * 2']
+
+    def setUp(self) -> None:
+        overload()
+
+    def test_postfix(self):
+        for expression in [*self.EXPRESSIONS, 'x ** 2 + dx(cos(exp(x)))']:
+            tree = as_expression(expression)
+            self.assertEqual(from_postfix(to_postfix(tree)), tree)
+        self.assertEqual(to_postfix(as_expression('2 * x')), ('i', 2, 'v', 'x', '*'))
+        with self.assertRaises(SerializeError):
+            from_postfix(('v', 'x', '+'))
+
+    def test_bytes(self):
+        for expression in [*self.EXPRESSIONS, 'x ** 2 + dx(cos(exp(x))) - 1e300 * -2 ** 70']:
+            tree = as_expression(expression)
+            self.assertEqual(from_bytes(to_bytes(tree)), tree)
+
+        numbers = bi.Add(bi.Add(lit.Real(-0.0), lit.Real(2)), bi.Add(lit.Int(-3), lit.Real(0.0)))
+        self.assertEqual(from_bytes(to_bytes(numbers)).as_display(), numbers.as_display())
+
+        inner = as_expression('sin(x * y) + z')
+        decoded = from_bytes(to_bytes(bi.Mul(inner, bi.Div(inner, inner))))
+        self.assertIs(decoded.left, decoded.right.left)
+        # equal subtrees are written once whether or not they are shared, so the encoding is a structural key
+        self.assertEqual(to_bytes(bi.Mul(inner, inner)), to_bytes(bi.Mul(inner, inner.copy())))
+
+        with self.assertRaises(SerializeError):
+            from_bytes(to_bytes(inner)[:-1])
+
+    def test_stream(self):
+        expressions = [as_expression(expression) for expression in self.EXPRESSIONS]
+        stream = io.BytesIO()
+        self.assertEqual(write_expressions(stream, expressions), len(expressions))
+        stream.seek(0)
+        self.assertEqual(list(read_expressions(stream)), expressions)
+
+        with self.assertRaises(SerializeError):
+            list(read_expressions(io.BytesIO(stream.getvalue()[:-3])))
+
+    def test_simplify_many(self):
+        expected = [simplify_expression(as_expression(expression)) for expression in self.EXPRESSIONS]
+        for workers in [1, 2]:
+            results = list(simplify_many([as_expression(expression) for expression in self.EXPRESSIONS], workers, 2))
+            self.assertEqual(results, expected)
+            self.assertIsNot(results[1], results[3])
+
+    def test_shared_duplicates(self):
+        inner = as_expression('sin(x * y) + z', cache=None)
+        shared, unshared = bi.Mul(inner, inner), bi.Mul(inner.copy(), inner.copy())
+        with mock.patch.object(executor.batch, '_simplify', wraps=executor.batch._simplify) as simplify:
+            results = list(simplify_many([shared, unshared], workers=1))
+        self.assertEqual(simplify.call_count, 1)
+        self.assertEqual(results[0], results[1])
+
+
+class TestCommandLine(unittest.TestCase):
+    def call(self, lines: list[str], *argv: str) -> tuple[int, str, str]:
+        options = main.arguments(list(argv))
+        out, err = io.StringIO(), io.StringIO()
+        failures = main.write(main.run(lines, options), options, out, err)
+        return failures, out.getvalue(), err.getvalue()
+
+    def test_text(self):
+        failures, out, err = self.call(['dx(x ** 2)\n', '\n', 'x +\n', '3 * 2\n'])
+        self.assertEqual((failures, out), (1, '2 * x\n\n\n6\n'))
+        self.assertTrue(err.startswith('line 3: ParseError'))
+
+    def test_jsonl(self):
+        lines = ['"x * y"', '{"expression": "x * y", "env": {"x": 3}}', '{"expression": "z"}']
+        failures, out, _ = self.call(lines, '-f', 'jsonl', '-m', 'evaluate', '-e', 'x=2', '-e', 'y=4', '-d', 'y')
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(records[:2], [{'line': 1, 'result': 2.0}, {'line': 2, 'result': 3.0}])
+        self.assertEqual(set(records[2]), {'line', 'error'})
+
+        # blank lines leave an empty text line and no json record, nan, which json lacks, is written as a string
+        failures, out, _ = self.call(['x - x', ' \n', 'x'], '-f', 'text', '-m', 'evaluate', '-e', 'x=inf')
+        self.assertEqual((failures, out), (0, 'nan\n\ninf\n'))
+        failures, out, _ = self.call(['"x - x"', ' \n', '"x"'], '-f', 'jsonl', '-m', 'evaluate', '-e', 'x=inf')
+        self.assertEqual([json.loads(line) for line in out.splitlines()],
+                         [{'line': 1, 'result': 'nan'}, {'line': 3, 'result': 'inf'}])
+
+    def test_workers(self):
+        lines = [f'dx(x ** {index})' for index in range(40)]
+        self.assertEqual(self.call(lines, '-w', '2', '-c', '3'), self.call(lines))
+
+
+class TestTape(unittest.TestCase):
+    EXPRESSIONS = ['dx(x ** 3 * sin(x))', '-(a - b) - -c / (d * e) ** 2', 'log(exp(-x)) / cos(x + 2.5)',
+                   'dy(dx(x * y ** 2 - x))', '2 ** 3 ** x - (x - (y - z))']
+
+    def setUp(self) -> None:
+        overload()
+
+    def test_convert(self):
+        for text in self.EXPRESSIONS:
+            expression = as_expression(text)
+            tape = Tape.from_node(expression)
+            self.assertEqual(tape.to_node(), expression, msg=text)
+            self.assertEqual(tape.as_display(), expression.as_display(), msg=text)
+
+        simplified = simplify_expression(as_expression('dx(x ** x * sin(x))'))
+        self.assertEqual(Tape.from_node(simplified).as_display(), simplified.as_display())
+
+        inner = as_expression('sin(x * y)')
+        tape = Tape.from_node(bi.Mul(inner, bi.Add(inner, lit.Real(-0.0))))
+        self.assertEqual((len(tape), tape.constants), (7, [-0.0]))
+        rebuilt = tape.to_node()
+        self.assertIs(rebuilt.left, rebuilt.right.left)
+
+    def test_evaluate(self):
+        env = {'x': 0.7, 'y': 1.3, 'a': 1.0, 'b': 2.0, 'c': 3.0, 'd': 4.0, 'e': 5.0, 'z': 0.5}
+        for text in self.EXPRESSIONS:
+            expression = as_expression(text)
+            self.assertAlmostEqual(evaluate_tape(Tape.from_node(expression), env), evaluate(expression, env), msg=text)
+        with self.assertRaises(EvaluatorError):
+            evaluate_tape(Tape.from_node(as_expression('x + w')), env)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_vectorized(self):
+        x = np.linspace(0.0, 1.0, 5)
+        tape = Tape.from_node(as_expression('dx(x ** 3 * y) + x'))
+        self.assertTrue(np.allclose(evaluate_tape(tape, {'x': x, 'y': 2.0}), 6 * x ** 2 + x))
+
+
+class TestCommonSubexpressions(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_bindings(self):
+        bindings, root = eliminate_common_subexpressions(as_expression('sin(c0 * x) / cos(c0 * x) + sin(c0 * x)'))
+        self.assertEqual(
+            display_bindings(bindings, root),
+            'c1 = c0 * x\nc2 = sin c1\nc2 / cos c1 + c2'
+        )
+
+    def test_nested_quotient(self):
+        expression = 'x'
+        for index in range(6):
+            expression = f'({expression}) / (sin(x) + {index})'
+        derivative = simplify_expression(as_expression(f'dx({expression})'))
+
+        bindings, root = eliminate_common_subexpressions(derivative)
+        expected = evaluate(derivative, {'x': 0.7})
+        self.assertAlmostEqual(evaluate_bindings(bindings, root, {'x': 0.7}), expected)
+        self.assertAlmostEqual(compile_expression(inline(bindings, root))(0.7), expected)
+
+    def test_derivative(self):
+        for text in ['dx(sin(x) * y) + sin(x) * y', 'dx(sin(x) * y) * dx(sin(x) * y) + x * y * (x * y)']:
+            expression = as_expression(text)
+            bindings, root = eliminate_common_subexpressions(expression)
+            env = {'x': 0.5, 'y': 2.0}
+            self.assertAlmostEqual(evaluate_bindings(bindings, root, env), evaluate(expression, env), msg=text)
+
+        bindings, root = eliminate_common_subexpressions(as_expression('dx(sin(x) * y) * dx(sin(x) * y)'))
+        self.assertEqual(display_bindings(bindings, root), 'c0 = d/dx (sin x * y)\nc0 * c0')
+
+    def test_share(self):
+        shared = share(as_expression('(a + b) * (a + b)'))
+        self.assertIs(shared.left, shared.right)
+
+
+class TestCompile(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_constant(self):
+        expression = as_expression('2 ** 3 * sin(1.0) - exp(-0.5) / log(4)')
+        self.assertAlmostEqual(compile_expression(expression)(), interpret_expression(expression))
+
+    def test_variables(self):
+        compiled = compile_expression(as_expression('x ** -2 * sin(y) + -x'), ['x', 'y'])
+        self.assertAlmostEqual(compiled(2.0, 1.0), 2.0 ** -2 * math.sin(1.0) - 2.0)
+        self.assertAlmostEqual(compiled(y=1.0, x=2.0), compiled(2.0, 1.0))
+
+    def test_cached(self):
+        self.assertIs(
+            compile_expression(as_expression('a * b + c')),
+            compile_expression(as_expression('a * b + c'))
+        )
+
+    def test_errors(self):
+        with self.assertRaises(CompileError):
+            compile_expression(as_expression('x + y'), ['x'])
+        with self.assertRaises(TypeError):
+            compile_expression(as_expression('dx(x)'))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestVectorized(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_broadcast(self):
+        x = np.linspace(0.1, 2.0, 5).reshape(5, 1)
+        y = np.linspace(-1.0, 1.0, 3)
+        expression = as_expression('sin(x) * y ** 2 + exp(-x) / log(x + 2) - 3')
+        result = evaluate_array(expression, {'x': x, 'y': y})
+        compiled = compile_expression(expression, ['x', 'y'])
+
+        self.assertEqual(result.shape, (5, 3))
+        for i in range(5):
+            for j in range(3):
+                self.assertAlmostEqual(result[i, j], compiled(x[i, 0], y[j]))
+
+    def test_constant(self):
+        result = evaluate_array(as_expression('2 * 3 + a - a'), {'a': np.zeros(4)})
+        self.assertEqual(result.tolist(), [6.0] * 4)
+        self.assertEqual(evaluate_array(as_expression('x'), {'x': [1.0, 2.0]}).tolist(), [1.0, 2.0])
+
+    def test_out(self):
+        out = np.empty(3)
+        self.assertIs(evaluate_array(as_expression('x * x'), {'x': np.arange(3.0)}, out=out), out)
+        self.assertEqual(out.tolist(), [0.0, 1.0, 4.0])
+
+
+class TestDeep(unittest.TestCase):
+    DEPTH = 2000  # over the recursion limit
+
+    def setUp(self) -> None:
+        overload()
+
+    def test_chain(self):
+        root = lit.Variable('a')
+        for index in range(self.DEPTH):
+            root = bi.Add(root, lit.Variable('b' if index % 2 else 'c'))
+
+        copied = root.copy()
+        self.assertEqual(copied, root)
+        self.assertEqual(len(root.as_display()), 4 * self.DEPTH + 1)
+        self.assertEqual(len(root.as_symbol()), 12 * self.DEPTH + 1)
+        self.assertTrue(root.weak_equals(copied))
+        self.assertEqual(simplify_expression(root, cache=None), nary.to_binary(nary.canonicalize(root)))
+
+    def test_evaluate(self):
+        root = lit.Real(1.0)
+        for index in range(self.DEPTH):
+            root = bi.Mul(lit.Real(1.0), bi.Add(root, lit.Real(1.0)))
+
+        self.assertEqual(interpret_expression(root), self.DEPTH + 1.0)
+        self.assertEqual(evaluate_tape(Tape.from_node(root), {}), self.DEPTH + 1.0)
+        self.assertEqual(Tape.from_node(root).as_display(), root.as_display())
+        self.assertEqual(simplify_expression(root, cache=None).as_display(), f'{self.DEPTH + 1.0}')
+
+
+class TestNAry(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_canonical(self):
+        expression = nary.canonicalize(as_expression('2 + x * 3 * (y * 2) + b + 1.5 + sin(x) + (a - 1)', cache=None))
+        self.assertIsInstance(expression, nary.Sum)
+        self.assertEqual(expression.as_display(), '3.5 + b + 6 * x * y + sin x + a - 1')
+        self.assertEqual(nary.to_binary(expression).as_display(), expression.as_display())
+        self.assertEqual(nary.canonicalize(as_expression('y + x', cache=None)),
+                         nary.canonicalize(as_expression('x + y', cache=None)))
+        self.assertEqual(nary.canonicalize(as_expression('x * 1 + 0', cache=None)), lit.Variable('x'))
+
+    def test_fold(self):
+        self.assertEqual(nary.Sum(lit.Int(1), lit.Int(2)).children, (lit.Int(3),))
+        self.assertEqual(nary.Product(lit.Real(2.0), nary.Product(lit.Variable('x'), lit.Int(3))).children,
+                         (lit.Real(6.0), lit.Variable('x')))
+        self.assertEqual(nary.Sum().as_display(), '0')
+
+    def test_order(self):
+        # the terms are ordered by structure, not by display, so equal displays are told apart
+        x, y, z = lit.Variable('x'), lit.Variable('y'), lit.Variable('z')
+        for left, right in [(fn.Sin(lit.Int(2)), fn.Sin(lit.Real(2))),
+                            (fn.Sin(lit.Real(0.0)), fn.Sin(lit.Real(-0.0))),
+                            (fn.Sin(x * y), fn.Sin(x * z))]:
+            self.assertEqual(nary.Sum(left, right, x).children, nary.Sum(right, x, left).children)
+            self.assertEqual(nary.Sum(left, right), nary.Sum(right, left))
+
+        # the order does not depend on the string hashes, which differ between processes
+        script = ('from symbols import nary; from symbols.overload import as_expression; '
+                  'from symbols.serialize import to_bytes; '
+                  'print(to_bytes(nary.canonicalize(as_expression("sin(x * y) + sin(x * z) + cos(b) * cos(a)"))).hex())')
+        outputs = {subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env={**os.environ, 'PYTHONHASHSEED': seed}, capture_output=True, text=True,
+                                  check=True).stdout for seed in ('1', '2', '3')}
+        self.assertEqual(len(outputs), 1)
+
+    def test_backends(self):
+        env = {'x': 0.3, 'y': -1.2, 'z': 2.0}
+        for text in ['x * y * z * x + 3', 'exp(x) * (x + y + 1) * 2 * y', '(x + y) * (y + x) / z']:
+            expression = as_expression(text, cache=None)
+            canonical = nary.canonicalize(expression)
+            value = evaluate(expression, env)
+            self.assertAlmostEqual(evaluate(canonical, env), value)
+            self.assertAlmostEqual(evaluate_tape(Tape.from_node(canonical), env), value)
+            self.assertAlmostEqual(compile_expression(canonical, 'xyz')(0.3, -1.2, 2.0), value)
+            self.assertEqual(from_bytes(to_bytes(canonical)), canonical)
+            self.assertEqual(from_postfix(to_postfix(canonical)), canonical)
+            for expected, actual in zip(gradient(expression, 'xyz', env), gradient(canonical, 'xyz', env)):
+                self.assertAlmostEqual(expected, actual)
+
+            derivative = simplify_expression(operator.Diff(canonical, 'x'), cache=None)
+            self.assertAlmostEqual(evaluate(derivative, env), forward_derivative(expression, 'x', env)[1])
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_vectorized(self):
+        expression = nary.canonicalize(as_expression('x * y * sin(x) * 2 + x + y + 1', cache=None))
+        x, y = np.linspace(0.0, 1.0, 7), np.linspace(1.0, 2.0, 7)
+        np.testing.assert_allclose(evaluate_array(expression, {'x': x, 'y': y}),
+                                   x * y * np.sin(x) * 2 + x + y + 1)
+
+
+class TestPolynomial(unittest.TestCase):
+    def setUp(self) -> None:
+        overload()
+
+    def test_expand(self):
+        expression = as_expression('(x + 2 * y) ** 3 - x * y / 2 + 7 - -x', cache=None)
+        polynomial = Polynomial.from_node(expression)
+        self.assertEqual((len(polynomial), polynomial.degree(), polynomial.degree('y')), (7, 3, 3))
+        self.assertEqual(polynomial.to_node().as_display(),
+                         '7 + x + -0.5 * x * y + x ^ 3 + 6 * x ^ 2 * y + 12 * x * y ^ 2 + 8 * y ^ 3')
+
+        env = {'x': 0.7, 'y': -1.3}
+        self.assertAlmostEqual(polynomial.evaluate(env), evaluate(expression, env))
+        self.assertAlmostEqual(polynomial.diff('x').evaluate(env), forward_derivative(expression, 'x', env)[1])
+        self.assertEqual(Polynomial.from_node(polynomial.to_node()), polynomial)
+
+    def test_arithmetic(self):
+        x, y = Polynomial.variable('x'), Polynomial.variable('y')
+        self.assertEqual((x + y) * (x - y), x ** 2 - y ** 2)
+        self.assertEqual(2 * x + 1, 1 + x * 2)
+        self.assertEqual((x - x).to_node(), lit.Int(0))
+        self.assertEqual(len((x + y + 1) ** 10), 66)
+        self.assertEqual(x.diff('y').degree(), -1)
+
+    def test_errors(self):
+        for text in ['x / y', 'x ** y', 'x ** 2.5', 'x / (1 - 1)', 'sin(x)']:
+            with self.assertRaises(PolynomialError, msg=text):
+                Polynomial.from_node(as_expression(text, cache=None))
+        with self.assertRaises(PolynomialError):
+            Polynomial.from_node(as_expression('(x + y + z) ** 30', cache=None), max_terms=100)
+
+    def test_rule(self):
+        fit = make.polynomial([float(index % 7 - 3) for index in range(30)])
+        simplified = simplify_expression(operator.Diff(fit, 'x'), cache=None)
+        # the children are simplified first, 1.0 * x ^ 4 loses its coefficient
+        expanded = Polynomial.from_node(simplify_expression(fit, cache=None))
+        self.assertEqual(simplified, nary.to_binary(nary.canonicalize(expanded.diff('x').to_node())))
+        self.assertAlmostEqual(evaluate(simplified, {'x': 0.9}), forward_derivative(fit, 'x', {'x': 0.9})[1])
+
+        # factored forms expand into more terms than they have leaves, so are left to the arithmetic rules
+        self.assertFalse(PolynomialRule().match(as_expression('dx((x + 1) ** 6 * (x - 2) ** 5)', cache=None)))
+        self.assertFalse(PolynomialRule().match(as_expression('dx(x ** y)', cache=None)))
+
+    def test_bounds(self):
+        expression = as_expression('(x + 2 * y) ** 3 - x * y / 2', cache=None)
+        self.assertEqual(expression.polynomial_bounds, (3, 5, 7))
+        for text in ['sin(x) + 1', 'x / y', 'x ** y', 'x ** 2.5', 'x / (1 - 1)', 'dx(x ** 2)']:
+            self.assertEqual(as_expression(text, cache=None).polynomial_bounds[0], -1, msg=text)
+
+        # the bounds of the ancestors are computed again once a descendant is replaced
+        expression.right.left.right = as_expression('y ** 5', cache=None)
+        self.assertEqual(expression.polynomial_bounds, (6, 5, 8))
+
+    def test_simplify(self):
+        # the polynomials are expanded outside of derivatives too, factored forms are kept
+        for text, expected in [('x * y ** 4 - y ** 4 * x + x', 'x'),
+                               ('x ** 4 / 3 + x ** 4 / 6 + y', '(x ^ 4 + 2 * y) / 2'),
+                               ('(x + 1) ** 5 * sin(x)', '(1 + x) ^ 5 * sin x')]:
+            self.assertEqual(simplify_expression(as_expression(text, cache=None), cache=None).as_display(), expected)
+
+    def test_exact(self):
+        # integer quotients stay exact, over the common denominator of the coefficients
+        for text, expected in [('dx(x ** 4 / 3)', '(4 * x ^ 3) / 3'),
+                               ('dx((2 * x ** 4 + 4 * x) / 2)', '2 + 4 * x ^ 3'),
+                               ('dx((x - 1) ** 4 - (x + 1) ** 4)', '4 * (x - 1) ^ 3 - 4 * (1 + x) ^ 3')]:
+            self.assertEqual(simplify_expression(as_expression(text, cache=None), cache=None).as_display(), expected)
+        self.assertEqual(Polynomial.from_node(as_expression('x / 3 * 6', cache=None)).to_node(),
+                         bi.Mul(lit.Int(2), lit.Variable('x')))
+
+
 if __name__ == '__main__':
     unittest.main()